@@ -6,10 +6,29 @@
 
 """
 
-import pandas as pd 
+import pandas as pd
+import numpy as np
 import json
+import re
+import time
+import random
+import asyncio
+import threading
+import hashlib
+import statistics
+import zlib
+import sqlite3
+import pickle
+import argparse
 import uuid
+import contextvars
+import functools
+import importlib.util
+import multiprocessing
 import requests
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from requests.adapters import HTTPAdapter
 from langchain_gigachat import GigaChat
 import os
 from dotenv import load_dotenv
@@ -17,31 +36,1894 @@ from dotenv import load_dotenv
 load_dotenv()
 
 
+class Telemetry:
+    """ Замеры этапов конвейера: каждый этап и каждый вызов GigaChat записывается спаном 
+        с длительностью, размерами промпта и ответа, токенами из поля usage, повторами и попаданиями в кэш. 
+        Спаны вкладываются друг в друга, агент наследуется от родительского спана. 
+        Итоги по агентам и этапам копятся сразу, а сами спаны хранятся не больше max_spans
+    """
+
+    SUMMED_FIELDS = ("rows", "prompt_chars", "completion_chars", "prompt_tokens", "completion_tokens", "total_tokens", "retries", "cache_hit")
+
+    current_span = contextvars.ContextVar("telemetry_span", default=None)
+
+    def __init__(self, enabled: bool = True, max_spans: int = 100000): 
+        self.enabled = enabled
+        self.max_spans = max_spans
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self): 
+        """ Начинаем новый запуск: спаны и итоги предыдущего сбрасываются """
+        with self.lock:
+            self.run_id = uuid.uuid4().hex
+            self.spans = []
+            self.totals = {}
+            self.span_count = 0
+
+    @contextmanager
+    def span(self, name: str, agent: str = None, **attributes): 
+        """ Замеряем этап, атрибуты можно дополнять внутри блока через возвращаемый словарь """
+        if not self.enabled:
+            yield attributes
+            return
+
+        parent = self.current_span.get()
+        record = {
+            "run_id": self.run_id, 
+            "name": name, 
+            "agent": agent or (parent["agent"] if parent is not None else None), 
+            "parent": parent["name"] if parent is not None else None, 
+            "start": time.time()
+        }
+        context_token = self.current_span.set(record)
+        started = time.perf_counter()
+
+        try:
+            yield attributes
+        except BaseException as error:
+            attributes["error"] = type(error).__name__
+            raise
+        finally:
+            self.current_span.reset(context_token)
+            record["duration"] = time.perf_counter() - started
+            record.update(attributes)
+            self.add(record)
+
+    def trace(self, name: str, agent: str = None): 
+        """ Декоратор: вызов метода записывается спаном, число строк берется из первого DataFrame в аргументах, 
+            агент - из STATE_KEY объекта, если не задан явно
+        """
+        def decorator(function):
+            def span_for(args: tuple, kwargs: dict):
+                rows = next((len(arg) for arg in list(args) + list(kwargs.values()) if isinstance(arg, pd.DataFrame)), None)
+                return self.span(name, agent=agent or (getattr(args[0], 'STATE_KEY', None) if args else None), rows=rows)
+
+            if asyncio.iscoroutinefunction(function):
+                @functools.wraps(function)
+                async def async_wrapper(*args, **kwargs):
+                    with span_for(args, kwargs):
+                        return await function(*args, **kwargs)
+                return async_wrapper
+
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with span_for(args, kwargs):
+                    return function(*args, **kwargs)
+            return wrapper
+
+        return decorator
+
+    def add(self, record: dict): 
+        """ Сохраняем спан и добавляем его к итогам по агенту и этапу """
+        key = (record["agent"], record["name"])
+        with self.lock:
+            self.span_count += 1
+            if len(self.spans) < self.max_spans:
+                self.spans.append(record)
+
+            totals = self.totals.setdefault(key, dict.fromkeys(("count", "seconds", "errors") + self.SUMMED_FIELDS, 0))
+            totals["count"] += 1
+            totals["seconds"] += record["duration"]
+            totals["errors"] += "error" in record
+            for field in self.SUMMED_FIELDS:
+                value = record.get(field)
+                if value is not None:
+                    totals[field] += value
+
+    def summary(self) -> pd.DataFrame: 
+        """ Итоги запуска по агентам и этапам: число вызовов, время, строки, токены, повторы и попадания в кэш. 
+            Время вложенных этапов входит и в родительский этап
+        """
+        with self.lock:
+            rows = [{"agent": agent, "stage": name, **totals} for (agent, name), totals in self.totals.items()]
+        summary = pd.DataFrame(rows, columns=["agent", "stage", "count", "seconds", "errors"] + list(self.SUMMED_FIELDS))
+        return summary.sort_values(["agent", "seconds"], ascending=[True, False], na_position='first').reset_index(drop=True)
+
+    def export_json(self, path: str): 
+        """ Выгружаем спаны структурированным логом: один JSON объект на строку """
+        with self.lock:
+            spans = list(self.spans)
+        with open(path, 'w', encoding='utf-8') as file:
+            for record in spans:
+                file.write(json.dumps(record, ensure_ascii=False, default=str) + '\n')
+
+    def export_prometheus(self, path: str): 
+        """ Выгружаем итоги в текстовом формате Prometheus """
+        metrics = {
+            "seconds": ("ai_etl_stage_seconds_total", "Время этапа, секунды"), 
+            "count": ("ai_etl_stage_calls_total", "Число вызовов этапа"), 
+            "errors": ("ai_etl_stage_errors_total", "Число вызовов этапа, завершившихся ошибкой"), 
+            "rows": ("ai_etl_stage_rows_total", "Число обработанных строк"), 
+            "prompt_tokens": ("ai_etl_prompt_tokens_total", "Токены промптов по данным API"), 
+            "completion_tokens": ("ai_etl_completion_tokens_total", "Токены ответов по данным API"), 
+            "retries": ("ai_etl_retries_total", "Повторы запросов к API"), 
+            "cache_hit": ("ai_etl_cache_hits_total", "Ответы, взятые из кэша")
+        }
+        with self.lock:
+            totals = dict(self.totals)
+
+        lines = []
+        for field, (metric, description) in metrics.items():
+            lines.append(f"# HELP {metric} {description}")
+            lines.append(f"# TYPE {metric} counter")
+            for (agent, name), values in totals.items():
+                lines.append(f'{metric}{{agent="{agent or ""}",stage="{name}"}} {values[field]}')
+
+        with open(path, 'w', encoding='utf-8') as file:
+            file.write('\n'.join(lines) + '\n')
+
+
+# Общий сборщик замеров для всех клиентов и агентов модуля
+TELEMETRY = Telemetry()
+
+
+class CsvChunkReader:
+    """ Чтение CSV файла порциями строк через chunksize """
+
+    def __init__(self, path: str = "data_edtech.csv", batch_size: int = 50000, sep: str = ',', dtype: dict = None): 
+        self.path = path
+        self.batch_size = batch_size
+        self.sep = sep
+        # Явные типы колонок: иначе pandas выводит тип для каждой порции отдельно
+        self.dtype = dtype
+
+    def iter_batches(self): 
+        """ Отдаем DataFrame по batch_size строк """
+        with pd.read_csv(self.path, sep=self.sep, dtype=self.dtype, chunksize=self.batch_size) as reader:
+            for batch in reader:
+                yield batch
+
+
+class ParquetReader:
+    """ Чтение Parquet файла батчами через pyarrow, в памяти не больше одной группы строк """
+
+    def __init__(self, path: str, batch_size: int = 50000, columns: list = None): 
+        self.path = path
+        self.batch_size = batch_size
+        self.columns = columns
+
+    def iter_batches(self): 
+        """ Отдаем DataFrame по batch_size строк """
+        # pyarrow нужен только для Parquet, поэтому импортируем его при использовании
+        import pyarrow.parquet as pq
+
+        parquet_file = pq.ParquetFile(self.path)
+        for record_batch in parquet_file.iter_batches(batch_size=self.batch_size, columns=self.columns):
+            yield record_batch.to_pandas()
+
+
+class SqlCursorReader:
+    """ Чтение таблицы из базы данных через DB-API курсор и fetchmany """
+
+    def __init__(self, connection, query: str, params: tuple = (), batch_size: int = 50000): 
+        self.connection = connection
+        self.query = query
+        self.params = params
+        self.batch_size = batch_size
+
+    def iter_batches(self): 
+        """ Отдаем DataFrame по batch_size строк """
+        cursor = self.connection.cursor()
+        try:
+            cursor.execute(self.query, self.params)
+            columns = [description[0] for description in cursor.description]
+            while True:
+                rows = cursor.fetchmany(self.batch_size)
+                if not rows:
+                    break
+                yield pd.DataFrame.from_records(rows, columns=columns)
+        finally:
+            cursor.close()
+
+
 class DataSourceClient:
     """ Клиент по управлению источниками данных. 
         В этом классе созданы синтетические данные из 100 строк: 
         - 80% корректные 
         - 20% неккоректные 
-        которые преобразуются в json структуру
+        которые преобразуются в json структуру. 
+        Данные читаются батчами через reader: CsvChunkReader, ParquetReader или SqlCursorReader
     """
 
+    def __init__(self, reader=None): 
+        self.reader = reader or CsvChunkReader("data_edtech.csv")
+
+    def iter_batches(self): 
+        """ Потоково отдаем датасет батчами DataFrame, чтение каждого батча замеряется """
+        batches = iter(self.reader.iter_batches())
+        while True:
+            with TELEMETRY.span("source.read") as span:
+                batch = next(batches, None)
+                span["rows"] = len(batch) if batch is not None else 0
+            if batch is None:
+                return
+            yield batch
+
     def create_dataset(self) -> pd.DataFrame: 
-        """ Читаем датасет с данными """
-        data_edtech = pd.read_csv("data_edtech.csv", sep=',')
+        """ Читаем датасет с данными целиком """
+        data_edtech = pd.concat(list(self.iter_batches()), ignore_index=True)
         return data_edtech
     
     def dataset_from_dataframe_to_json(self, dataset_edtech: pd.DataFrame) -> json: 
-        """ Преобразовываем DataFrame в json структуру """
-        records = dataset_edtech.to_dict('records')
-        json_string = json.dumps(records, indent=2)
+        """ Преобразовываем DataFrame в json структуру без промежуточного списка словарей """
+        json_string = dataset_edtech.to_json(orient='records', indent=2, force_ascii=False)
         return json_string
 
 
+# Описание полей датасета передается моделью один раз системным сообщением, а не в каждом промпте
+DATASET_GLOSSARY = """ Ты работаешь с датасетом данных о студентах. Датасет содержит поля: 
+    - student_id - уникальный идентификатор студента
+    - full_name - ФИО студента
+    - email - электронная почта студента
+    - phone_number - мобильный номер телефона студента
+    - date_of_birth - дата рождения студента
+    - age - возраст студента
+    - admission_year - год поступления в учебное заведение
+    - faculty - факультет, на котором учится студента
+    - group_name - наименование группы обучения
+    - gpa - средний балл студента 
+    - last_test_score -  балл за последний сданный экзамен или тест
+    - attendance_percent - процент посещаемости занятий
+    - scholarship_amount - размер стипендии в рублях
+    - extracurricular_activities - внеучебные активности
+    - on_probation - находится ли студент на академическом испытательном сроке 
+    - has_dormitory - проживает ли студент в общежитии
+    - enrollment_status - текущий статус обучения студента
+    - preferred_language - предпочитаемый язык для обучения или язык, на котором обучается студент
+    - mentor_id - идентификатор ментора
+    - average_study_hours - среднее количество часов, которое тратит на самостоятельное обучение студент
+    - library_visits_per_month - среднее количество посещений библиотеки в месяц
+    Если в данных есть поле anomalies, в нем перечислены найденные заранее межстрочные признаки строки: 
+    dup_student_id / dup_email - student_id или email встречается у других строк, same_full_name - такое же ФИО у других строк, 
+    near_dup_full_name / near_dup_email - почти совпадающие ФИО или email у других строк, outlier_mentor_id - идентификатор ментора необычного вида или с номером вне диапазона остальных, 
+    group_faculty_mismatch - префикс группы принадлежит другому факультету, age_birth_mismatch - возраст не сходится с датой рождения, 
+    admission_age - возраст на момент поступления вне 15-70 лет, on_probation - студент на испытательном сроке, сверь со средним баллом. 
+    Число после = - количество таких строк
+"""
+
+
+class PromptSerializer:
+    """ Компактная сериализация строк датасета для промптов. Форматы: 
+        - json - список объектов с отступами (названия полей повторяются в каждой строке)
+        - csv / tsv - заголовок один раз, дальше только значения
+        - columnar - json объект, где для каждого поля передается список значений
+        - dictionary - csv, в котором значения колонок с небольшим числом уникальных значений 
+          (faculty, enrollment_status, preferred_language) заменены кодами из словаря
+    """
+
+    FORMATS = ("json", "csv", "tsv", "columnar", "dictionary")
+
+    FORMAT_DESCRIPTIONS = {
+        "json": "JSON список объектов", 
+        "csv": "CSV с разделителем ',' и названиями полей в первой строке", 
+        "tsv": "TSV с разделителем табуляции и названиями полей в первой строке", 
+        "columnar": "JSON объект, где для каждого поля указан список значений по строкам", 
+        "dictionary": "CSV с названиями полей в первой строке, значения некоторых полей заменены кодами из словарей, приведенных перед таблицей"
+    }
+
+    def __init__(self, format: str = "csv", chars_per_token: float = 3.0, dictionary_max_unique: int = 64, count_tokens=None): 
+        if format not in self.FORMATS:
+            raise ValueError(f"Неизвестный формат сериализации: {format}")
+        self.format = format
+        self.chars_per_token = chars_per_token
+        # Колонка кодируется словарем, если в ней не больше dictionary_max_unique уникальных значений
+        self.dictionary_max_unique = dictionary_max_unique
+        # Функция точного подсчета токенов, если есть (например, через токенизатор модели)
+        self.count_tokens = count_tokens
+
+    def describe(self, format: str = None) -> str: 
+        """ Описание формата данных для текста промпта """
+        return self.FORMAT_DESCRIPTIONS[format or self.format]
+
+    def to_json(self, dataset_edtech: pd.DataFrame) -> str: 
+        return dataset_edtech.to_json(orient='records', indent=2, force_ascii=False)
+
+    def to_csv(self, dataset_edtech: pd.DataFrame, sep: str = ',') -> str: 
+        return dataset_edtech.to_csv(index=False, sep=sep, lineterminator='\n')
+
+    def to_columnar(self, dataset_edtech: pd.DataFrame) -> str: 
+        columns = {
+            str(column): dataset_edtech[column].astype(object).where(dataset_edtech[column].notna(), None).tolist() 
+            for column in dataset_edtech.columns
+        }
+        return json.dumps(columns, ensure_ascii=False, separators=(',', ':'), default=str)
+
+    def dictionary_columns(self, dataset_edtech: pd.DataFrame) -> list: 
+        """ Колонки, которые выгодно закодировать словарем: текстовые и с малым числом уникальных значений """
+        columns = []
+        for column in dataset_edtech.columns:
+            values = dataset_edtech[column]
+            if pd.api.types.is_numeric_dtype(values) or pd.api.types.is_bool_dtype(values):
+                continue
+            unique_count = values.nunique()
+            if 0 < unique_count <= self.dictionary_max_unique and unique_count < len(values) / 2:
+                columns.append(column)
+        return columns
+
+    def to_dictionary(self, dataset_edtech: pd.DataFrame) -> str: 
+        encoded = dataset_edtech.copy()
+        dictionaries = []
+        for column in self.dictionary_columns(dataset_edtech):
+            codes, categories = pd.factorize(dataset_edtech[column])
+            encoded[column] = pd.Series(codes, index=dataset_edtech.index).replace(-1, np.nan).astype('Int64')
+            dictionaries.append(f"{column}: " + "; ".join(f"{code}={value}" for code, value in enumerate(categories)))
+        if not dictionaries:
+            return self.to_csv(encoded)
+        return "Словари:\n" + "\n".join(dictionaries) + "\n\n" + self.to_csv(encoded)
+
+    @TELEMETRY.trace("serialize")
+    def serialize(self, dataset_edtech: pd.DataFrame, format: str = None) -> str: 
+        """ Сериализуем строки датасета в выбранном формате """
+        format = format or self.format
+        if format == "json":
+            return self.to_json(dataset_edtech)
+        if format == "csv":
+            return self.to_csv(dataset_edtech)
+        if format == "tsv":
+            return self.to_csv(dataset_edtech, sep='\t')
+        if format == "columnar":
+            return self.to_columnar(dataset_edtech)
+        if format == "dictionary":
+            return self.to_dictionary(dataset_edtech)
+        raise ValueError(f"Неизвестный формат сериализации: {format}")
+
+    def estimate_tokens(self, text: str) -> int: 
+        """ Считаем токены точно, если задана функция подсчета, иначе оцениваем по длине текста """
+        if self.count_tokens is not None:
+            return self.count_tokens(text)
+        return int(np.ceil(len(text) / self.chars_per_token))
+
+    def estimate_row_chars(self, dataset_edtech: pd.DataFrame) -> np.ndarray: 
+        """ Оцениваем длину каждой строки в выбранном формате, без сериализации датасета """
+        # для json к значению добавляются название поля, кавычки и отступы, для табличных форматов - разделитель
+        with_names = self.format in ("json", "columnar")
+        row_chars = np.full(len(dataset_edtech), 4 if with_names else 1, dtype=np.int64)
+        for column in dataset_edtech.columns:
+            values = dataset_edtech[column].astype(str).str.len().fillna(3).to_numpy(dtype=np.int64)
+            row_chars += values + (len(str(column)) + 10 if self.format == "json" else 2)
+        return row_chars
+
+    def token_report(self, dataset_edtech: pd.DataFrame) -> dict: 
+        """ Количество токенов промпта с данными для каждого формата """
+        return {format: self.estimate_tokens(self.serialize(dataset_edtech, format=format)) for format in self.FORMATS}
+
+    def densest_format(self, dataset_edtech: pd.DataFrame) -> str: 
+        """ Формат, в котором данные занимают меньше всего токенов """
+        report = self.token_report(dataset_edtech)
+        return min(report, key=report.get)
+
+
+class DatasetChunker:
+    """ Разбиение датасета на порции строк, каждая из которых помещается в один промпт """
+
+    def __init__(self, max_tokens: int = 6000, max_rows: int = 50, chars_per_token: float = 3.0, stable_boundaries: bool = True, 
+                 serializer: PromptSerializer = None):
+        # Бюджет токенов на данные в одном промпте (без учета текста самого промпта)
+        self.max_tokens = max_tokens
+        # Модель возвращает строки обратно, поэтому ограничиваем и их количество
+        self.max_rows = max_rows
+        # Грубая оценка: сколько символов json приходится на один токен
+        self.chars_per_token = chars_per_token
+        # Границы порций определяются содержимым строк: вставка или изменение строки 
+        # меняет только свою порцию, остальные промпты совпадают с прошлым запуском и берутся из кэша
+        self.stable_boundaries = stable_boundaries
+        # Формат, в котором строки попадут в промпт; без него длина оценивается для json с отступами
+        self.serializer = serializer
+
+    def estimate_tokens(self, text: str) -> int:
+        """ Оцениваем количество токенов в тексте """
+        return int(np.ceil(len(text) / self.chars_per_token))
+
+    def estimate_row_tokens(self, dataset_edtech: pd.DataFrame) -> np.ndarray:
+        """ Оцениваем количество токенов для каждой строки в формате промпта """
+        if self.serializer is not None:
+            return np.ceil(self.serializer.estimate_row_chars(dataset_edtech) / self.chars_per_token).astype(np.int64)
+
+        # ключ, кавычки, двоеточие, запятая и отступ для каждого поля
+        row_chars = np.full(len(dataset_edtech), 4, dtype=np.int64)
+        for column in dataset_edtech.columns:
+            values = dataset_edtech[column].astype(str).str.len().fillna(3).to_numpy(dtype=np.int64)
+            row_chars += values + len(str(column)) + 10
+        return np.ceil(row_chars / self.chars_per_token).astype(np.int64)
+
+    @TELEMETRY.trace("chunk.split")
+    def split(self, dataset_edtech: pd.DataFrame) -> list:
+        """ Делим DataFrame на порции строк по бюджету токенов """
+        row_tokens = self.estimate_row_tokens(dataset_edtech)
+        cumulative = np.cumsum(row_tokens)
+
+        # Строка-граница: хэш её значений делится на среднюю длину порции
+        boundaries = np.array([], dtype=np.int64)
+        if self.stable_boundaries and len(dataset_edtech):
+            row_hashes = pd.util.hash_pandas_object(dataset_edtech, index=False).to_numpy()
+            boundaries = np.flatnonzero(row_hashes % np.uint64(max(self.max_rows // 2, 1)) == 0)
+
+        chunks = []
+        start = 0
+        while start < len(dataset_edtech):
+            consumed = cumulative[start - 1] if start > 0 else 0
+            end = int(np.searchsorted(cumulative, consumed + self.max_tokens, side='right'))
+            # строка, которая одна превышает бюджет, всё равно уходит отдельной порцией
+            end = min(max(end, start + 1), start + self.max_rows)
+
+            # Закрываем порцию на первой строке-границе, если она укладывается в бюджет
+            position = np.searchsorted(boundaries, start)
+            if position < len(boundaries) and boundaries[position] < end:
+                end = int(boundaries[position]) + 1
+
+            chunks.append(dataset_edtech.iloc[start:end])
+            start = end
+
+        return chunks
+
+
+class StreamingRowParser:
+    """ Инкрементальный разбор JSON ответа модели: строки с student_id отдаются по мере того, 
+        как в потоке закрывается их объект, не дожидаясь конца ответа
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self.position = 0
+        self.starts = []
+        self.in_string = False
+        self.escaped = False
+
+    def feed(self, text: str) -> list:
+        """ Добавляем очередной фрагмент ответа и возвращаем законченные в нем строки """
+        self.buffer += text
+        rows = []
+
+        for position in range(self.position, len(self.buffer)):
+            char = self.buffer[position]
+
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif char == '\\':
+                    self.escaped = True
+                elif char == '"':
+                    self.in_string = False
+            elif char == '"':
+                self.in_string = True
+            elif char == '{':
+                self.starts.append(position)
+            elif char == '}' and self.starts:
+                start = self.starts.pop()
+                try:
+                    row = json.loads(self.buffer[start:position + 1])
+                except json.JSONDecodeError:
+                    continue
+                if isinstance(row, dict) and 'student_id' in row:
+                    rows.append(row)
+
+        self.position = len(self.buffer)
+
+        # Вне объектов разобранный текст больше не нужен
+        if not self.starts:
+            self.buffer, self.position = "", 0
+
+        return rows
+
+
+class RowSchema:
+    """ Схема построчного ответа модели: для числового поля задается диапазон (min, max), 
+        для поля с метками - список допустимых значений
+    """
+
+    def __init__(self, fields: dict):
+        self.fields = fields
+
+    @property
+    def columns(self) -> list:
+        return list(self.fields)
+
+    @staticmethod
+    def row_key(student_id) -> str: 
+        """ Ключ строки - student_id строкой: идентификаторы бывают не числовыми (S-001), 
+            а модель может вернуть числовой идентификатор как 1, 1.0 или "1"
+        """
+        if student_id is None or (isinstance(student_id, float) and np.isnan(student_id)):
+            return None
+        if isinstance(student_id, (float, np.floating)) and float(student_id).is_integer():
+            student_id = int(student_id)
+        key = str(student_id).strip()
+        return key or None
+
+    def validate(self, row: dict) -> dict:
+        """ Приводим строку ответа к типам схемы, строка с пропущенным или некорректным полем отбрасывается """
+        student_id = self.row_key(row.get('student_id'))
+        if student_id is None:
+            return None
+
+        result = {'student_id': student_id}
+        for field, spec in self.fields.items():
+            value = row.get(field)
+
+            if isinstance(spec, tuple):
+                if isinstance(value, str):
+                    value = value.strip().replace(',', '.')
+                try:
+                    value = float(value)
+                except (TypeError, ValueError):
+                    return None
+                if not spec[0] <= value <= spec[1]:
+                    return None
+            else:
+                value = str(value).strip().lower() if value is not None else None
+                if value not in spec:
+                    return None
+
+            result[field] = value
+
+        return result
+
+    def empty_frame(self, index: pd.Index) -> pd.DataFrame:
+        """ Типизированные столбцы вердиктов: числа - float, метки - категории из допустимых значений """
+        return pd.DataFrame({
+            field: pd.Series(np.nan, index=index, dtype=float) if isinstance(spec, tuple) 
+            else pd.Series(pd.Categorical([None] * len(index), categories=spec), index=index)
+            for field, spec in self.fields.items()
+        }, index=index)
+
+
+class ChunkResultAggregator:
+    """ Сборка ответов модели по порциям данных в один результат """
+
+    def get_content(self, response: dict) -> str:
+        """ Достаем текст ответа модели """
+        return response['choices'][0]['message']['content']
+
+    def parse_json_object(self, content: str) -> dict:
+        """ Достаем json объект из ответа модели """
+        start, end = content.find('{'), content.rfind('}')
+        if start == -1 or end <= start:
+            return {}
+        try:
+            result = json.loads(content[start:end + 1])
+        except json.JSONDecodeError:
+            return {}
+        return result if isinstance(result, dict) else {}
+
+    def parse_score(self, content: str) -> float:
+        """ Достаем оценку от 0 до 1 из ответа модели """
+        for value in re.findall(r'\d+(?:[.,]\d+)?', content):
+            score = float(value.replace(',', '.'))
+            if 0 <= score <= 1:
+                return score
+        return None
+
+    def join_verdicts(self, dataset_edtech: pd.DataFrame, verdicts: list, schema: RowSchema) -> pd.DataFrame:
+        """ Присоединяем типизированные вердикты порций к датасету по индексу строк, 
+            строки, не отправленные в модель, получают пустые вердикты
+        """
+        joined = schema.empty_frame(dataset_edtech.index)
+        for verdict in verdicts:
+            for column in schema.columns:
+                joined.loc[verdict.index, column] = verdict[column]
+
+        dataset_edtech = dataset_edtech.drop(columns=[c for c in schema.columns if c in dataset_edtech.columns])
+        return pd.concat([dataset_edtech, joined], axis=1).reset_index(drop=True)
+
+    def apply_rule_verdicts(self, dataset_edtech: pd.DataFrame, rule_verdict: np.ndarray, passed: dict, failed: dict) -> pd.DataFrame:
+        """ Проставляем значения полей для строк, решение по которым вынесли правила """
+        dataset_edtech = dataset_edtech.copy()
+        for column in passed:
+            values = dataset_edtech[column].copy()
+            values[rule_verdict == RuleEngine.PASSED] = passed[column]
+            values[rule_verdict == RuleEngine.FAILED] = failed[column]
+            dataset_edtech[column] = values
+        return dataset_edtech
+
+    def chunk_row_scores(self, dataset_edtech: pd.DataFrame, chunks: list, scores: list, initial: np.ndarray = None) -> np.ndarray:
+        """ Проставляем каждой строке оценку её порции, строки без оценки остаются NaN """
+        row_scores = pd.Series(np.nan if initial is None else initial, index=dataset_edtech.index, dtype=float)
+        for chunk, score in zip(chunks, scores):
+            if score is not None:
+                row_scores.loc[chunk.index] = score
+        return row_scores.to_numpy()
+
+    def chunk_row_ids(self, dataset_edtech: pd.DataFrame, chunks: list) -> np.ndarray:
+        """ Номер порции каждой строки, строки, не отправленные в модель, получают -1 """
+        row_ids = pd.Series(-1, index=dataset_edtech.index, dtype=np.int64)
+        for number, chunk in enumerate(chunks):
+            row_ids.loc[chunk.index] = number
+        return row_ids.to_numpy()
+
+    def batch_row_scores(self, result) -> np.ndarray: 
+        """ Построчные оценки из результата агента по батчу: DataFrame с row_score или словарь с row_scores """
+        if isinstance(result, dict):
+            return np.asarray(result["row_scores"], dtype=float)
+        return pd.to_numeric(result["row_score"], errors='coerce').to_numpy(dtype=float)
+
+    def batch_row_chunks(self, result) -> np.ndarray: 
+        """ Номера порций строк из результата агента с оценками по порциям (row_chunks в словаре или колонка row_chunk), 
+            None - оценки построчные
+        """
+        if isinstance(result, dict) and "row_chunks" in result:
+            return np.asarray(result["row_chunks"], dtype=np.int64)
+        if isinstance(result, pd.DataFrame) and "row_chunk" in result.columns:
+            return result["row_chunk"].to_numpy(dtype=np.int64)
+        return None
+
+    def batch_rows(self, dataset_edtech: pd.DataFrame, result) -> pd.DataFrame: 
+        """ Построчный результат агента по батчу для записи: таблица строк как есть, 
+            у агентов с оценками по порциям - student_id и row_score
+        """
+        if isinstance(result, pd.DataFrame):
+            return result
+        return pd.DataFrame({"student_id": dataset_edtech["student_id"].to_numpy(), "row_score": self.batch_row_scores(result)})
+
+    def mean_score(self, row_scores: np.ndarray) -> float:
+        """ Оценка по датасету - среднее построчных оценок, то есть среднее оценок порций, взвешенное по числу строк """
+        row_scores = np.asarray(row_scores, dtype=float)
+        if np.isnan(row_scores).all():
+            return None
+        return float(np.nanmean(row_scores))
+
+
+class RuleEngine:
+    """ Детерминированные проверки строк датасета средствами pandas/numpy. 
+        Каждая проверка возвращает по строке: 1 - прошла, 0 - не прошла, -1 - неоднозначно. 
+        В модель отправляются только строки, по которым правила не смогли вынести решение. 
+        Отклонение от среднего зависит от распределения значений и строку не бракует: 
+        оно решает только поле is_valid, а строка все равно оценивается моделью
+    """
+
+    PASSED, FAILED, AMBIGUOUS = 1, 0, -1
+
+    EMAIL_PATTERN = r'^[\w.+-]+@[\w-]+(?:\.[\w-]+)+$'
+    PHONE_PATTERN = r'^\+7\d{10}$'
+    # Номер в другом формате записи или иностранный номер - решение остается за моделью
+    PHONE_LOOSE_PATTERN = r'^(?:(?:\+7|8)\d{10}|\+\d{10,14})$'
+
+    def __init__(self, data_error_standart: dict = None, ambiguity_factor: float = 2.0): 
+        # Нормы отклонения от среднего без учета выбросов, None - поле не проверяется
+        self.data_error_standart = data_error_standart or {}
+        # Отклонение больше нормы, но меньше нормы * ambiguity_factor считается неоднозначным
+        self.ambiguity_factor = ambiguity_factor
+        # Допустимые диапазоны значений (границы включительно)
+        self.value_ranges = {
+            "gpa": (0, 5), 
+            "last_test_score": (0, 100), 
+            "attendance_percent": (0, 100), 
+            "age": (15, 70), 
+            "admission_year": (1990, pd.Timestamp.now().year)
+        }
+
+    def robust_mean(self, values: pd.Series) -> float: 
+        """ Среднее значение без учета выбросов за пределами 1.5 межквартильного размаха """
+        values = values.dropna()
+        q1, q3 = values.quantile([0.25, 0.75])
+        iqr = q3 - q1
+        inliers = values[(values >= q1 - 1.5 * iqr) & (values <= q3 + 1.5 * iqr)]
+        return float(inliers.mean())
+
+    def robust_means(self, dataset_edtech: pd.DataFrame) -> dict: 
+        """ Средние без учета выбросов по проверяемым полям - статистики всего батча, 
+            при делении батча на шарды считаются до деления
+        """
+        return {
+            column: self.robust_mean(pd.to_numeric(dataset_edtech[column], errors='coerce')) 
+            for column, limit in self.data_error_standart.items() if limit is not None and column in dataset_edtech.columns
+        }
+
+    def check_deviation(self, values: pd.Series, limit: float, mean: float) -> np.ndarray: 
+        """ Проверяем отклонение значения от среднего без учета выбросов """
+        deviation = (pd.to_numeric(values, errors='coerce') - mean).abs().to_numpy()
+        return np.select(
+            [np.isnan(deviation), deviation <= limit, deviation <= limit * self.ambiguity_factor], 
+            [self.AMBIGUOUS, self.PASSED, self.AMBIGUOUS], 
+            default=self.FAILED
+        )
+
+    def check_range(self, values: pd.Series, low: float, high: float) -> np.ndarray: 
+        """ Проверяем попадание значения в допустимый диапазон """
+        values = pd.to_numeric(values, errors='coerce').to_numpy(dtype=float)
+        return np.select(
+            [np.isnan(values), (values >= low) & (values <= high)], 
+            [self.AMBIGUOUS, self.PASSED], 
+            default=self.FAILED
+        )
+
+    def check_email(self, values: pd.Series) -> np.ndarray: 
+        """ Проверяем формат электронной почты, пустое значение считаем ошибкой """
+        matched = values.astype('string').str.fullmatch(self.EMAIL_PATTERN).fillna(False).to_numpy(dtype=bool)
+        return np.where(matched, self.PASSED, self.FAILED)
+
+    def check_phone(self, values: pd.Series) -> np.ndarray: 
+        """ Проверяем формат мобильного номера """
+        values = values.astype('string')
+        strict = values.str.fullmatch(self.PHONE_PATTERN).fillna(False).to_numpy(dtype=bool)
+        loose = values.str.replace(r'[\s\-()]', '', regex=True).str.fullmatch(self.PHONE_LOOSE_PATTERN).fillna(False).to_numpy(dtype=bool)
+        return np.select([strict, loose], [self.PASSED, self.AMBIGUOUS], default=self.FAILED)
+
+    def check_date(self, values: pd.Series) -> np.ndarray: 
+        """ Проверяем, что дата рождения существует и не находится в будущем """
+        dates = pd.to_datetime(values, format='%Y-%m-%d', errors='coerce')
+        valid = (dates.notna() & (dates <= pd.Timestamp.now())).to_numpy(dtype=bool)
+        return np.where(valid, self.PASSED, self.FAILED)
+
+    def run_checks(self, dataset_edtech: pd.DataFrame, means: dict = None) -> pd.DataFrame: 
+        """ Выполняем все проверки, результат - таблица проверок по строкам. 
+            means - средние без учета выбросов, если не заданы, считаются по переданным строкам
+        """
+        checks = {}
+        means = means if means is not None else self.robust_means(dataset_edtech)
+
+        for column, mean in means.items(): 
+            checks[f"{column}_deviation"] = self.check_deviation(dataset_edtech[column], self.data_error_standart[column], mean)
+
+        for column, (low, high) in self.value_ranges.items(): 
+            if column in dataset_edtech.columns:
+                checks[f"{column}_range"] = self.check_range(dataset_edtech[column], low, high)
+
+        if "email" in dataset_edtech.columns:
+            checks["email_format"] = self.check_email(dataset_edtech["email"])
+        if "phone_number" in dataset_edtech.columns:
+            checks["phone_format"] = self.check_phone(dataset_edtech["phone_number"])
+        if "date_of_birth" in dataset_edtech.columns:
+            checks["date_of_birth_valid"] = self.check_date(dataset_edtech["date_of_birth"])
+
+        return pd.DataFrame(checks, index=dataset_edtech.index)
+
+    @TELEMETRY.trace("rules.screen")
+    def screen(self, dataset_edtech: pd.DataFrame, means: dict = None) -> pd.DataFrame: 
+        """ Выносим решение по строке: rule_verdict 1 - все проверки пройдены, 0 - не пройдена проверка диапазона, 
+            формата или даты, NaN - решение должна принять модель. 
+            deviation_verdict - решение только по отклонениям от среднего (поле is_valid), NaN - решает модель. 
+            В rule_violations перечислены непройденные проверки
+        """
+        checks = self.run_checks(dataset_edtech, means=means)
+        deviation = checks.columns.str.endswith("_deviation")
+        results = checks.to_numpy()
+        hard_results = results[:, ~deviation]
+        deviation_results = results[:, deviation]
+
+        failed = (hard_results == self.FAILED).any(axis=1)
+        undecided = (results != self.PASSED).any(axis=1)
+        verdict = np.where(failed, 1.0 * self.FAILED, np.where(undecided, np.nan, 1.0 * self.PASSED))
+
+        if deviation.any():
+            deviation_failed = (deviation_results == self.FAILED).any(axis=1)
+            deviation_ambiguous = (deviation_results == self.AMBIGUOUS).any(axis=1)
+            deviation_verdict = np.where(deviation_failed, 1.0 * self.FAILED, np.where(deviation_ambiguous, np.nan, 1.0 * self.PASSED))
+        else:
+            deviation_verdict = np.full(len(dataset_edtech), np.nan)
+
+        violations = pd.Series('', index=dataset_edtech.index)
+        for name in checks.columns:
+            violations = violations + np.where(checks[name].to_numpy() == self.FAILED, name + ';', '')
+
+        return pd.DataFrame(
+            {"rule_verdict": verdict, "deviation_verdict": deviation_verdict, "rule_violations": violations}, index=dataset_edtech.index
+        )
+
+
+class TokenBucket:
+    """ Ограничитель частоты запросов по алгоритму token bucket """
+
+    def __init__(self, rate: float, capacity: int):
+        # rate - сколько запросов в секунду пополняется, capacity - допустимый всплеск запросов
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated_at = time.monotonic()
+
+    async def acquire(self):
+        """ Ждем, пока в корзине появится свободный токен """
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class ConsistencyIndex:
+    """ Индекс межстрочной согласованности, строится одним проходом по данным до запросов к модели: 
+        - хэш индексы ключей: повторы student_id и email
+        - профиль идентификаторов (например, mentor_id): значения необычного вида или с номером вне основного диапазона
+        - таблица факультет x префикс группы: группа с префиксом другого факультета
+        - MinHash/LSH по full_name и email: почти совпадающие значения у разных строк
+        - поля внутри строки: возраст и дата рождения, возраст поступления, испытательный срок
+        Жесткие нарушения (HARD_FLAGS) решают согласованность строки без модели, строка без признаков согласована, 
+        остальные признаки передаются модели компактной колонкой anomalies вместо соседних строк
+    """
+
+    HARD_FLAGS = ("dup_student_id", "dup_email", "group_faculty_mismatch")
+    NEAR_DUPLICATE_COLUMNS = ("full_name", "email")
+    ID_COLUMNS = ("mentor_id",)
+    # Допустимый возраст на момент поступления (границы включительно)
+    ADMISSION_AGE = (15, 70)
+    FALSE_VALUES = ("false", "0", "n", "no", "нет")
+
+    def __init__(self, num_perm: int = 64, bands: int = 16, shingle_size: int = 3, similarity: float = 0.6, seed: int = 0): 
+        # num_perm хэш функций MinHash делятся на bands полос LSH по num_perm // bands значений
+        self.num_perm = num_perm
+        self.bands = bands
+        self.shingle_size = shingle_size
+        # Минимальное сходство Жаккара по n-граммам, начиная с которого значения считаются почти совпадающими
+        self.similarity = similarity
+        self.seed = seed
+        self.built = False
+        # Номер построения: пул процессов перезапускается, если индекс перестроен после передачи в процессы
+        self.version = 0
+
+    def normalize(self, values: pd.Series) -> pd.Series: 
+        """ Приводим строковые значения к общему виду: нижний регистр, без лишних пробелов """
+        return values.astype('string').str.strip().str.lower().str.replace(r'\s+', ' ', regex=True)
+
+    def group_prefix(self, group_names: pd.Series) -> pd.Series: 
+        """ Префикс группы - буквы до номера, например CS для CS-202 """
+        return group_names.astype('string').str.extract(r'^\s*([^\W\d_]+)', expand=False).str.upper()
+
+    def build(self, data_source: DataSourceClient) -> "ConsistencyIndex": 
+        """ Один проход по батчам: счетчики ключей, частоты и различные значения для MinHash """
+        self.key_counts = {"student_id": pd.Series(dtype=np.int64), "email": pd.Series(dtype=np.int64), "full_name": pd.Series(dtype=np.int64)}
+        self.frequencies = {column: pd.Series(dtype=np.int64) for column in self.ID_COLUMNS}
+        faculty_prefix = None
+        self.age_years = pd.Series(dtype=np.int64)
+
+        for batch in data_source.iter_batches():
+            if 'student_id' in batch.columns:
+                self.add_counts("student_id", batch['student_id'].map(RowSchema.row_key))
+            for column in self.NEAR_DUPLICATE_COLUMNS:
+                if column in batch.columns:
+                    self.add_counts(column, self.normalize(batch[column]))
+            for column in self.ID_COLUMNS:
+                if column in batch.columns:
+                    self.frequencies[column] = self.frequencies[column].add(batch[column].astype('string').value_counts(), fill_value=0)
+            if 'age' in batch.columns and 'date_of_birth' in batch.columns:
+                self.age_years = self.age_years.add(self.age_year(batch).value_counts(), fill_value=0)
+            if 'faculty' in batch.columns and 'group_name' in batch.columns:
+                pairs = pd.DataFrame({'faculty': batch['faculty'].astype('string'), 'prefix': self.group_prefix(batch['group_name'])}).dropna()
+                counts = pairs.value_counts()
+                faculty_prefix = counts if faculty_prefix is None else faculty_prefix.add(counts, fill_value=0)
+
+        # Для каждого префикса группы - факультет, у которого он встречается чаще всего
+        self.faculty_prefix = faculty_prefix
+        # Год, на который указан возраст, общий для таблицы: чаще всего встречающийся год рождения + возраст
+        self.reference_year = float(self.age_years.idxmax()) if len(self.age_years) else np.nan
+        if faculty_prefix is not None and len(faculty_prefix):
+            prefix_table = faculty_prefix.rename('count').reset_index()
+            leaders = prefix_table[prefix_table['count'] == prefix_table.groupby('prefix')['count'].transform('max')]
+            # При равных частотах владелец префикса не определен, такие группы не помечаем
+            self.prefix_owner = leaders[~leaders.duplicated('prefix', keep=False)].set_index('prefix')
+        else:
+            self.prefix_owner = pd.DataFrame(columns=['faculty', 'count'])
+
+        self.near_duplicates = {column: self.find_near_duplicates(self.key_counts[column].index) for column in self.NEAR_DUPLICATE_COLUMNS}
+        self.id_profiles = {column: self.id_profile(self.frequencies[column]) for column in self.ID_COLUMNS}
+        self.built = True
+        self.version += 1
+        return self
+
+    def birth_year(self, dataset_edtech: pd.DataFrame) -> pd.Series: 
+        return pd.to_datetime(dataset_edtech['date_of_birth'], format='%Y-%m-%d', errors='coerce').dt.year
+
+    def age_year(self, dataset_edtech: pd.DataFrame) -> pd.Series: 
+        """ Год рождения + возраст: у согласованных строк это год, на который указан возраст """
+        return (self.birth_year(dataset_edtech) + pd.to_numeric(dataset_edtech['age'], errors='coerce')).dropna()
+
+    def id_shape(self, values: pd.Series) -> pd.Series: 
+        """ Вид идентификатора: буквы заменяются на A, цифры на 9, например MENT-101 -> AAAA-999 """
+        return values.astype('string').str.replace(r'[^\W\d_]', 'A', regex=True).str.replace(r'\d', '9', regex=True)
+
+    def id_number(self, values: pd.Series) -> pd.Series: 
+        """ Номер в идентификаторе - последняя группа цифр """
+        return pd.to_numeric(values.astype('string').str.extract(r'(\d+)\D*$', expand=False), errors='coerce')
+
+    def id_profile(self, frequencies: pd.Series) -> dict: 
+        """ Профиль идентификаторов по частотам значений: доли видов записи и основной диапазон номеров 
+            (1.5 межквартильного размаха), значения вне профиля отличаются от остальных, а не просто редки 
+        """
+        values = pd.Series(frequencies.index, dtype='string')
+        counts = pd.Series(frequencies.to_numpy(), dtype=float)
+        shapes = counts.groupby(self.id_shape(values).to_numpy()).sum() / max(counts.sum(), 1.0)
+
+        numbers = self.id_number(values)
+        known = numbers.notna().to_numpy()
+        if known.sum() < 4:
+            return {"shapes": shapes, "low": -np.inf, "high": np.inf}
+        expanded = np.repeat(numbers[known].to_numpy(dtype=float), counts[known].to_numpy(dtype=np.int64))
+        q1, q3 = np.quantile(expanded, [0.25, 0.75])
+        return {"shapes": shapes, "low": q1 - 1.5 * (q3 - q1), "high": q3 + 1.5 * (q3 - q1)}
+
+    def add_counts(self, key: str, values: pd.Series): 
+        self.key_counts[key] = self.key_counts[key].add(values.value_counts(), fill_value=0)
+
+    def shingles(self, value: str) -> set: 
+        size = self.shingle_size
+        return {value[i:i + size] for i in range(max(1, len(value) - size + 1))}
+
+    def find_near_duplicates(self, values: pd.Index) -> pd.Series: 
+        """ MinHash подписи различных значений и LSH по полосам: значения из одной корзины сравниваются 
+            с первым значением корзины, поэтому сравнений O(n), а не O(n^2). 
+            Возвращаем для каждого значения число найденных почти совпадающих с ним других значений
+        """
+        values = [value for value in values if isinstance(value, str) and len(value) >= self.shingle_size]
+        if len(values) < 2:
+            return pd.Series(dtype=np.int64)
+
+        shingle_sets = [self.shingles(value) for value in values]
+        hashes = np.fromiter((zlib.crc32(shingle.encode()) for shingles in shingle_sets for shingle in shingles), dtype=np.uint64)
+        lengths = np.fromiter((len(shingles) for shingles in shingle_sets), dtype=np.int64, count=len(values))
+        starts = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+
+        # Универсальное хэширование (a * x + b) mod p, p - простое больше 2^32, поэтому в uint64 нет переполнения
+        prime = np.uint64(4294967311)
+        rng = np.random.default_rng(self.seed)
+        a = rng.integers(1, 2 ** 32 - 1, self.num_perm, dtype=np.uint64)
+        b = rng.integers(0, 2 ** 32 - 1, self.num_perm, dtype=np.uint64)
+        signatures = np.empty((len(values), self.num_perm), dtype=np.uint64)
+        for permutation in range(self.num_perm):
+            signatures[:, permutation] = np.minimum.reduceat((a[permutation] * hashes + b[permutation]) % prime, starts)
+
+        rows = self.num_perm // self.bands
+        multipliers = rng.integers(1, 2 ** 63, rows, dtype=np.uint64) | np.uint64(1)
+        positions = pd.Series(np.arange(len(values)))
+        left, right = [], []
+        for band in range(self.bands):
+            band_keys = (signatures[:, band * rows:(band + 1) * rows] * multipliers).sum(axis=1)
+            first = positions.groupby(band_keys).transform('first').to_numpy()
+            candidates = first != positions.to_numpy()
+            left.append(first[candidates])
+            right.append(positions.to_numpy()[candidates])
+
+        pairs = np.unique(np.stack([np.concatenate(left), np.concatenate(right)], axis=1), axis=0)
+        # Сходство Жаккара оцениваем по доле совпавших значений подписей, без сравнения множеств n-грамм
+        similar = pairs[(signatures[pairs[:, 0]] == signatures[pairs[:, 1]]).mean(axis=1) >= self.similarity]
+        counts = np.bincount(similar.ravel(), minlength=len(values))
+
+        near_duplicates = pd.Series(counts, index=values)
+        return near_duplicates[near_duplicates > 0]
+
+    @TELEMETRY.trace("index.features")
+    def features(self, dataset_edtech: pd.DataFrame) -> pd.DataFrame: 
+        """ Признаки аномалий по строкам батча в его порядке. 
+            index_verdict - 0, если есть жесткое нарушение, 1, если признаков нет, иначе NaN (решает модель), 
+            index_violations - жесткие нарушения, anomalies - все признаки одной строкой для промпта
+        """
+        if not self.built:
+            raise Exception("Индекс согласованности не построен: сначала вызовите build")
+
+        index = dataset_edtech.index
+        features = pd.DataFrame(index=index)
+
+        def repeats(key: str, values: pd.Series) -> np.ndarray:
+            return (values.map(self.key_counts[key]).fillna(1) - 1).clip(lower=0).to_numpy(dtype=np.int64)
+
+        empty = np.zeros(len(index), dtype=np.int64)
+        features['dup_student_id'] = repeats("student_id", dataset_edtech['student_id'].map(RowSchema.row_key)) if 'student_id' in dataset_edtech else empty
+        features['dup_email'] = repeats("email", self.normalize(dataset_edtech['email'])) if 'email' in dataset_edtech else empty
+        features['same_full_name'] = repeats("full_name", self.normalize(dataset_edtech['full_name'])) if 'full_name' in dataset_edtech else empty
+
+        for column in self.NEAR_DUPLICATE_COLUMNS:
+            if column in dataset_edtech.columns:
+                values = self.normalize(dataset_edtech[column])
+                features[f'near_dup_{column}'] = values.map(self.near_duplicates[column]).fillna(0).to_numpy(dtype=np.int64)
+            else:
+                features[f'near_dup_{column}'] = empty
+
+        for column in self.ID_COLUMNS:
+            if column in dataset_edtech.columns:
+                profile = self.id_profiles[column]
+                values = dataset_edtech[column].astype('string')
+                # Вид записи, встречающийся меньше чем у 5% значений, или номер вне основного диапазона
+                odd_shape = self.id_shape(values).map(profile["shapes"]).fillna(0) < 0.05
+                number = self.id_number(values)
+                odd_number = (number < profile["low"]) | (number > profile["high"])
+                outlier = values.notna() & (odd_shape | odd_number.fillna(False))
+                features[f'outlier_{column}'] = outlier.fillna(False).to_numpy(dtype=np.int64)
+            else:
+                features[f'outlier_{column}'] = empty
+
+        if 'age' in dataset_edtech.columns and 'date_of_birth' in dataset_edtech.columns:
+            age_year = self.birth_year(dataset_edtech) + pd.to_numeric(dataset_edtech['age'], errors='coerce')
+            features['age_birth_mismatch'] = ((age_year - self.reference_year).abs() > 1).to_numpy(dtype=np.int64)
+        else:
+            features['age_birth_mismatch'] = empty
+
+        if 'admission_year' in dataset_edtech.columns and 'date_of_birth' in dataset_edtech.columns:
+            low, high = self.ADMISSION_AGE
+            admission_age = pd.to_numeric(dataset_edtech['admission_year'], errors='coerce') - self.birth_year(dataset_edtech)
+            features['admission_age'] = ((admission_age < low) | (admission_age > high)).to_numpy(dtype=np.int64)
+        else:
+            features['admission_age'] = empty
+
+        # Испытательный срок сверяется со средним баллом моделью, поэтому строку с ним или с неясным значением 
+        # нельзя считать согласованной без модели
+        if 'on_probation' in dataset_edtech.columns:
+            probation = dataset_edtech['on_probation'].astype('string').str.strip().str.lower()
+            features['on_probation'] = (probation.notna() & ~probation.isin(self.FALSE_VALUES)).to_numpy(dtype=np.int64)
+        else:
+            features['on_probation'] = empty
+
+        if 'faculty' in dataset_edtech.columns and 'group_name' in dataset_edtech.columns:
+            owner = self.group_prefix(dataset_edtech['group_name']).map(self.prefix_owner['faculty'])
+            mismatch = owner.notna() & (owner != dataset_edtech['faculty'].astype('string'))
+            features['group_faculty_mismatch'] = mismatch.fillna(False).to_numpy(dtype=np.int64)
+        else:
+            features['group_faculty_mismatch'] = empty
+
+        flags = list(features.columns)
+        hard = features[list(self.HARD_FLAGS)].to_numpy() > 0
+
+        violations = pd.Series('', index=index)
+        anomalies = pd.Series('', index=index)
+        for column in flags:
+            values = features[column]
+            if column in self.HARD_FLAGS:
+                violations = violations + np.where(values > 0, column + ';', '')
+            # Для счетчиков больше 1 указываем значение, например same_full_name=3
+            counted = (column + '=' + values.astype(str) + ';').where(values > 1, np.where(values > 0, column + ';', ''))
+            anomalies = anomalies + counted
+
+        features['index_violations'] = violations.to_numpy()
+        features['anomalies'] = anomalies.to_numpy()
+        features['index_verdict'] = np.where(hard.any(axis=1), 1.0 * RuleEngine.FAILED, 
+                                             np.where(anomalies.to_numpy() == '', 1.0 * RuleEngine.PASSED, np.nan))
+        return features
+
+
+class PartitionedExecutor:
+    """ Выполнение локальных этапов батча (проверки правил, признаки индекса согласованности) в пуле процессов. 
+        Батч делится на шарды по хэшу student_id, шарды передаются в процессы и обратно в формате Arrow IPC 
+        вместо pickle DataFrame, результаты собираются в исходном порядке строк. 
+        Статистики всего батча (средние без выбросов) считаются до деления и передаются этапам параметрами, 
+        поэтому результат совпадает с однопроцессным запуском. Запросы к модели остаются в основном процессе. 
+        Без установленного pyarrow этапы выполняются в основном процессе
+    """
+
+    # Этапы, зарегистрированные в процессе пула при его запуске
+    worker_stages = {}
+
+    def __init__(self, processes: int = None, shards: int = None, key: str = "student_id", min_rows: int = 10000): 
+        self.processes = processes or os.cpu_count() or 1
+        self.shards = shards or self.processes
+        self.key = key
+        # Небольшие батчи быстрее обработать в основном процессе, чем передавать в пул
+        self.min_rows = min_rows
+        self.stages = {}
+        self.versions = {}
+        self.executor = None
+        # pyarrow не входит в обязательные зависимости, без него пул не запускается
+        self.arrow = importlib.util.find_spec("pyarrow") is not None
+
+    @staticmethod
+    def init_worker(stages: dict): 
+        """ Этапы передаются в процесс один раз при запуске пула, а не с каждым шардом """
+        PartitionedExecutor.worker_stages = stages
+        # Спаны процессов пула в основной процесс не попадают, замеряем шарды целиком в основном процессе
+        TELEMETRY.enabled = False
+
+    @staticmethod
+    def to_arrow(dataset_edtech: pd.DataFrame): 
+        """ DataFrame в Arrow IPC. Колонки со смешанными типами Arrow не принимает, такие таблицы передаются как есть """
+        # pyarrow нужен только для параллельного режима, поэтому импортируем его при использовании
+        import pyarrow as pa
+
+        try:
+            table = pa.Table.from_pandas(dataset_edtech, preserve_index=False)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            return dataset_edtech.reset_index(drop=True)
+
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        return sink.getvalue().to_pybytes()
+
+    @staticmethod
+    def from_arrow(payload) -> pd.DataFrame: 
+        import pyarrow as pa
+
+        if isinstance(payload, pd.DataFrame):
+            return payload
+        return pa.ipc.open_stream(payload).read_all().to_pandas()
+
+    @staticmethod
+    def run_shard(payload, params: dict) -> dict: 
+        """ Выполняем этапы над одним шардом в процессе пула """
+        shard = PartitionedExecutor.from_arrow(payload)
+        return {
+            name: PartitionedExecutor.to_arrow(PartitionedExecutor.worker_stages[name](shard, **stage_params)) 
+            for name, stage_params in params.items()
+        }
+
+    def shard_ids(self, dataset_edtech: pd.DataFrame) -> np.ndarray: 
+        """ Номер шарда строки по хэшу ключа, без ключа - по номеру строки """
+        if self.key not in dataset_edtech.columns:
+            return np.arange(len(dataset_edtech)) % self.shards
+        hashes = pd.util.hash_pandas_object(dataset_edtech[self.key], index=False).to_numpy()
+        return (hashes % np.uint64(self.shards)).astype(np.int64)
+
+    @staticmethod
+    def stage_version(function): 
+        """ Номер состояния объекта этапа (например, ConsistencyIndex.version): метод перестроенного объекта 
+            равен прежнему, но в процессах пула осталась старая копия объекта
+        """
+        return getattr(getattr(function, '__self__', None), 'version', None)
+
+    def get_executor(self, stages: dict) -> ProcessPoolExecutor: 
+        """ Пул запускается при первом использовании и перезапускается, если добавлены новые этапы 
+            или объект этапа изменился с запуска пула
+        """
+        if any(self.stages.get(name) != function or self.versions.get(name) != self.stage_version(function) 
+               for name, function in stages.items()):
+            self.close()
+            self.stages = {**self.stages, **stages}
+            self.versions = {name: self.stage_version(function) for name, function in self.stages.items()}
+        if self.executor is None:
+            # Процессы запускаются через spawn: fork копирует блокировки, захваченные потоками клиента GigaChat, 
+            # и процесс пула может зависнуть на них
+            self.executor = ProcessPoolExecutor(max_workers=self.processes, mp_context=multiprocessing.get_context("spawn"), 
+                                                initializer=self.init_worker, initargs=(self.stages,))
+        return self.executor
+
+    async def arun(self, dataset_edtech: pd.DataFrame, stages: dict) -> dict: 
+        """ Выполняем этапы {имя: (функция, параметры)} над батчем, результат - {имя: DataFrame} с индексом батча """
+        if len(dataset_edtech) < self.min_rows or self.processes < 2 or not self.arrow:
+            return {name: function(dataset_edtech, **params) for name, (function, params) in stages.items()}
+
+        executor = self.get_executor({name: function for name, (function, params) in stages.items()})
+        params = {name: params for name, (function, params) in stages.items()}
+
+        shard_ids = self.shard_ids(dataset_edtech)
+        positions = [np.flatnonzero(shard_ids == shard) for shard in range(self.shards)]
+        positions = [shard_positions for shard_positions in positions if len(shard_positions)]
+
+        with TELEMETRY.span("partition.run", rows=len(dataset_edtech), shards=len(positions)):
+            loop = asyncio.get_running_loop()
+            payloads = [self.to_arrow(dataset_edtech.iloc[shard_positions]) for shard_positions in positions]
+            shard_results = await asyncio.gather(*[loop.run_in_executor(executor, self.run_shard, payload, params) for payload in payloads])
+
+        # Строки шардов возвращаем в порядок батча
+        order = np.argsort(np.concatenate(positions), kind='stable')
+        results = {}
+        for name in stages:
+            result = pd.concat([self.from_arrow(shard_result[name]) for shard_result in shard_results], ignore_index=True).iloc[order]
+            result.index = dataset_edtech.index
+            results[name] = result
+        return results
+
+    def close(self): 
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+
+class ResponseCache:
+    """ Дисковый кэш ответов GigaChat в SQLite. 
+        Ключ - хэш модели, температуры и текста промпта, записи живут ttl секунд, 
+        при превышении max_bytes вытесняются давно не использованные записи (LRU)
+    """
+
+    def __init__(self, path: str = "gigachat_cache.sqlite", ttl: float = 7 * 24 * 3600, max_bytes: int = 512 * 1024 * 1024, 
+                 evict_every: int = 100):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        # Проверяем размер кэша раз в evict_every записей, а не на каждую запись
+        self.evict_every = evict_every
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.lock = threading.Lock()
+
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY, 
+                response TEXT NOT NULL, 
+                size INTEGER NOT NULL, 
+                created_at REAL NOT NULL, 
+                last_access REAL NOT NULL
+            )
+        """)
+        self.connection.execute("CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)")
+        self.connection.commit()
+
+    def make_key(self, model: str, temperature: float, messages: list) -> str: 
+        """ Считаем ключ записи по параметрам запроса """
+        payload = json.dumps([model, temperature, messages], ensure_ascii=False)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> dict: 
+        """ Достаем ответ из кэша, просроченная запись считается промахом """
+        now = time.time()
+        with self.lock:
+            row = self.connection.execute("SELECT response, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None or now - row[1] > self.ttl:
+                self.misses += 1
+                return None
+            self.connection.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+            self.connection.commit()
+            self.hits += 1
+        return json.loads(row[0])
+
+    def set(self, key: str, response: dict): 
+        """ Сохраняем ответ модели """
+        now = time.time()
+        payload = json.dumps(response, ensure_ascii=False)
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO responses (key, response, size, created_at, last_access) VALUES (?, ?, ?, ?, ?)", 
+                (key, payload, len(payload.encode('utf-8')), now, now)
+            )
+            self.connection.commit()
+            self.writes += 1
+            if self.writes % self.evict_every == 0:
+                self.evict()
+
+    def evict(self): 
+        """ Удаляем просроченные записи и самые давно использованные сверх max_bytes """
+        self.connection.execute("DELETE FROM responses WHERE created_at < ?", (time.time() - self.ttl,))
+        self.connection.execute("""
+            DELETE FROM responses WHERE key IN (
+                SELECT key FROM (
+                    SELECT key, SUM(size) OVER (ORDER BY last_access DESC) AS total_size FROM responses
+                ) WHERE total_size > ?
+            )
+        """, (self.max_bytes,))
+        self.connection.commit()
+
+    def stats(self) -> dict: 
+        """ Счетчики попаданий и промахов кэша """
+        with self.lock:
+            entries, size = self.connection.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        requests_count = self.hits + self.misses
+        return {
+            "hits": self.hits, 
+            "misses": self.misses, 
+            "hit_rate": self.hits / requests_count if requests_count else 0.0, 
+            "entries": entries, 
+            "size_bytes": size
+        }
+
+    def close(self): 
+        with self.lock:
+            self.connection.close()
+
+
+class IncrementalState:
+    """ Построчное состояние оценки качества между запусками (SQLite). 
+        Для каждой строки хранится отпечаток её значений и последний вердикт агента, 
+        поэтому в модель отправляются только новые и измененные строки. 
+        Датасет может приходить батчами: удаленные строки определяются в finish_run 
+        по тому, что они не встретились ни в одном батче текущего запуска
+    """
+
+    def __init__(self, path: str = "quality_state.sqlite"): 
+        self.path = path
+        self.lock = threading.Lock()
+        self.run_ids = {}
+
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS row_state (
+                agent TEXT NOT NULL, 
+                row_key TEXT NOT NULL, 
+                fingerprint TEXT NOT NULL, 
+                verdict TEXT NOT NULL, 
+                score REAL, 
+                updated_at REAL NOT NULL, 
+                seen_run TEXT, 
+                PRIMARY KEY (agent, row_key)
+            )
+        """)
+        # Сколько раз student_id уже встретился в текущем запуске - для ключей повторяющихся student_id
+        self.connection.execute("""
+            CREATE TEMP TABLE run_occurrence (
+                agent TEXT NOT NULL, 
+                student_id TEXT NOT NULL, 
+                seen INTEGER NOT NULL, 
+                PRIMARY KEY (agent, student_id)
+            )
+        """)
+        self.connection.execute("CREATE TEMP TABLE batch_ids (student_id TEXT PRIMARY KEY, batch_count INTEGER NOT NULL)")
+        self.connection.execute("CREATE TEMP TABLE batch_keys (row_key TEXT PRIMARY KEY)")
+        self.connection.commit()
+
+    def start_run(self, agent: str): 
+        """ Начинаем новый запуск агента """
+        with self.lock:
+            self.run_ids[agent] = str(uuid.uuid4())
+            self.connection.execute("DELETE FROM run_occurrence WHERE agent = ?", (agent,))
+            self.connection.commit()
+
+    def finish_run(self, agent: str) -> int: 
+        """ Удаляем строки, которые не встретились в текущем запуске, возвращаем их количество """
+        with self.lock:
+            deleted = self.connection.execute(
+                "DELETE FROM row_state WHERE agent = ? AND (seen_run IS NULL OR seen_run != ?)", (agent, self.run_ids.pop(agent))
+            ).rowcount
+            self.connection.execute("DELETE FROM run_occurrence WHERE agent = ?", (agent,))
+            self.connection.commit()
+        return deleted
+
+    def stage_keys(self, keys: np.ndarray): 
+        """ Кладем ключи батча во временную таблицу для выборок по ним (вызывается под блокировкой) """
+        self.connection.execute("DELETE FROM batch_keys")
+        self.connection.executemany("INSERT OR IGNORE INTO batch_keys (row_key) VALUES (?)", ((key,) for key in keys))
+
+    def row_keys(self, agent: str, dataset_edtech: pd.DataFrame) -> np.ndarray: 
+        """ Ключ строки - student_id, повторные student_id получают номер вхождения с учетом прошлых батчей запуска. 
+            student_id приводится к виду RowSchema.row_key: в батче с пропущенным student_id pandas читает колонку как float, 
+            и без приведения ключ 1 превратился бы в 1.0
+        """
+        student_ids = dataset_edtech['student_id'].map(RowSchema.row_key).fillna('nan').astype(str)
+        occurrence = dataset_edtech.groupby(student_ids, sort=False).cumcount().to_numpy()
+        batch_counts = student_ids.value_counts(sort=False)
+
+        with self.lock:
+            self.connection.execute("DELETE FROM batch_ids")
+            self.connection.executemany(
+                "INSERT INTO batch_ids (student_id, batch_count) VALUES (?, ?)", ((key, int(count)) for key, count in batch_counts.items())
+            )
+            previous = dict(self.connection.execute(
+                "SELECT r.student_id, r.seen FROM run_occurrence r JOIN batch_ids b ON r.student_id = b.student_id WHERE r.agent = ?", 
+                (agent,)
+            ).fetchall())
+            self.connection.execute("""
+                INSERT INTO run_occurrence (agent, student_id, seen) SELECT ?, student_id, batch_count FROM batch_ids WHERE true 
+                ON CONFLICT (agent, student_id) DO UPDATE SET seen = seen + excluded.seen
+            """, (agent,))
+            self.connection.commit()
+
+        occurrence = occurrence + student_ids.map(previous).fillna(0).to_numpy(dtype=np.int64)
+        return np.where(occurrence > 0, student_ids + '#' + occurrence.astype(str), student_ids).astype(str)
+
+    def fingerprints(self, dataset_edtech: pd.DataFrame) -> np.ndarray: 
+        """ Отпечаток строки - хэш всех её значений. 
+            Типы колонок приводятся к общему виду, потому что при чтении батчами pandas выводит их для каждого батча по-своему 
+            (например, age бывает int64 или float64, а on_probation - bool или строкой)
+        """
+        normalized = {}
+        for column in dataset_edtech.columns:
+            values = dataset_edtech[column]
+            if pd.api.types.is_numeric_dtype(values) and not pd.api.types.is_bool_dtype(values):
+                normalized[column] = values.astype('float64')
+            else:
+                normalized[column] = values.astype('string')
+        return pd.util.hash_pandas_object(pd.DataFrame(normalized), index=False).to_numpy().astype(str)
+
+    @TELEMETRY.trace("state.diff")
+    def diff(self, agent: str, dataset_edtech: pd.DataFrame) -> dict: 
+        """ Находим вставленные и измененные строки батча относительно прошлого запуска, 
+            строки батча помечаются встреченными в текущем запуске
+        """
+        if agent not in self.run_ids:
+            self.start_run(agent)
+
+        keys = self.row_keys(agent, dataset_edtech)
+        fingerprints = self.fingerprints(dataset_edtech)
+
+        with self.lock:
+            self.stage_keys(keys)
+            stored = dict(self.connection.execute(
+                "SELECT s.row_key, s.fingerprint FROM row_state s JOIN batch_keys k ON s.row_key = k.row_key WHERE s.agent = ?", (agent,)
+            ).fetchall())
+            self.connection.execute(
+                "UPDATE row_state SET seen_run = ? WHERE agent = ? AND row_key IN (SELECT row_key FROM batch_keys)", 
+                (self.run_ids[agent], agent)
+            )
+            self.connection.commit()
+
+        previous = pd.Series(keys).map(stored).to_numpy()
+        inserted = pd.isna(previous)
+        updated = ~inserted & (previous != fingerprints)
+
+        return {
+            "keys": keys, 
+            "fingerprints": fingerprints, 
+            "inserted": inserted, 
+            "updated": updated, 
+            "changed": inserted | updated
+        }
+
+    @TELEMETRY.trace("state.update")
+    def update(self, agent: str, changes: dict, scored_rows: pd.DataFrame, columns: list) -> pd.DataFrame: 
+        """ Сохраняем вердикты по измененным строкам и возвращаем вердикты по всем строкам батча в его порядке """
+        changed = changes["changed"]
+        now = time.time()
+
+        # to_dict по пустому списку колонок не возвращает записей, поэтому задаем пустые вердикты явно
+        # NaN заменяем на null, чтобы вердикт оставался корректным JSON для json_extract
+        verdict_rows = scored_rows[columns].astype(object)
+        records = verdict_rows.where(verdict_rows.notna(), None).to_dict('records') if columns else [{}] * len(scored_rows)
+        verdicts = [
+            json.dumps(verdict, ensure_ascii=False, default=lambda value: value.item() if isinstance(value, np.generic) else str(value))
+            for verdict in records
+        ]
+        scores = [None if pd.isna(score) else float(score) for score in scored_rows['row_score']]
+
+        with self.lock:
+            self.connection.executemany(
+                """INSERT OR REPLACE INTO row_state (agent, row_key, fingerprint, verdict, score, updated_at, seen_run) 
+                   VALUES (?, ?, ?, ?, ?, ?, ?)""", 
+                zip([agent] * len(verdicts), changes["keys"][changed], changes["fingerprints"][changed], verdicts, scores, 
+                    [now] * len(verdicts), [self.run_ids[agent]] * len(verdicts))
+            )
+            self.stage_keys(changes["keys"])
+            stored = pd.read_sql_query(
+                "SELECT s.row_key, s.verdict, s.score FROM row_state s JOIN batch_keys k ON s.row_key = k.row_key WHERE s.agent = ?", 
+                self.connection, params=(agent,)
+            )
+            self.connection.commit()
+
+        stored = stored.set_index('row_key').reindex(changes["keys"])
+        result = pd.DataFrame([json.loads(verdict) if isinstance(verdict, str) else {} for verdict in stored['verdict']])
+        result = result.reindex(columns=columns)
+        result['row_score'] = stored['score'].to_numpy()
+        return result
+
+    def dataset_score(self, agent: str, field: str = None) -> float: 
+        """ Оценка по датасету - среднее построчных оценок из сохраненного состояния, 
+            field - имя оценки внутри вердикта, если агент хранит несколько оценок по строке
+        """
+        with self.lock:
+            if field is None:
+                score = self.connection.execute("SELECT AVG(score) FROM row_state WHERE agent = ?", (agent,)).fetchone()[0]
+            else:
+                score = self.connection.execute(
+                    "SELECT AVG(json_extract(verdict, '$.' || ?)) FROM row_state WHERE agent = ?", (field, agent)
+                ).fetchone()[0]
+        return score
+
+    def close(self): 
+        with self.lock:
+            self.connection.close()
+
+
+class CheckpointStore:
+    """ Контрольные точки запуска (SQLite): результат каждой обработанной порции строк сохраняется 
+        по этапу и отпечатку порции сразу после получения ответа модели. 
+        В отпечаток входят настройки этапа (шаблоны промптов, модель, температура, формат сериализации, нормы отклонения), 
+        поэтому после их изменения готовые результаты не переиспользуются. 
+        При запуске с resume=True готовые порции берутся из хранилища и в модель повторно не отправляются, 
+        без resume контрольные точки прошлого запуска удаляются. 
+        Дата запуска для промптов хранится вместе с контрольными точками: продолженный на другой день запуск 
+        строит те же промпты, что и прерванный
+    """
+
+    def __init__(self, path: str = "quality_checkpoints.sqlite", resume: bool = False): 
+        self.path = path
+        self.resume = resume
+        self.hits = 0
+        self.writes = 0
+        self.lock = threading.Lock()
+
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS chunk_checkpoint (
+                stage TEXT NOT NULL, 
+                chunk_key TEXT NOT NULL, 
+                result BLOB NOT NULL, 
+                created_at REAL NOT NULL, 
+                PRIMARY KEY (stage, chunk_key)
+            )
+        """)
+        self.connection.execute("CREATE TABLE IF NOT EXISTS run_meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        if not resume:
+            self.connection.execute("DELETE FROM chunk_checkpoint")
+            self.connection.execute("DELETE FROM run_meta")
+
+        row = self.connection.execute("SELECT value FROM run_meta WHERE key = 'run_date'").fetchone()
+        self.run_date = row[0] if row is not None else pd.Timestamp.now().strftime('%Y-%m-%d')
+        self.connection.execute("INSERT OR REPLACE INTO run_meta (key, value) VALUES ('run_date', ?)", (self.run_date,))
+        self.connection.commit()
+
+    @staticmethod
+    def checkpointed(stage: str = None, prompts: tuple = ("read_dataset_edtech_data_prompt",)): 
+        """ Декоратор process_chunk: если у объекта задано хранилище checkpoints, результат порции 
+            берется из него или сохраняется в него. Этап - stage или STATE_KEY объекта, 
+            prompts - методы объекта, которыми строятся промпты порции
+        """
+        def decorator(function):
+            @functools.wraps(function)
+            async def wrapper(self, chunk: pd.DataFrame):
+                checkpoints = getattr(self, 'checkpoints', None)
+                if checkpoints is None:
+                    return await function(self, chunk)
+                config = checkpoints.stage_config(self, prompts)
+                return await checkpoints.run(stage or self.STATE_KEY, chunk, lambda chunk: function(self, chunk), config=config)
+            return wrapper
+
+        return decorator
+
+    def stage_config(self, owner, prompts: tuple) -> str: 
+        """ Отпечаток настроек этапа: промпты без данных, системный промпт, модель, температура, 
+            формат сериализации и нормы отклонения от среднего
+        """
+        client = getattr(owner, 'client', None)
+        serializer = getattr(owner, 'serializer', None)
+        config = [
+            [getattr(owner, prompt)("") for prompt in prompts], 
+            DATASET_GLOSSARY, 
+            getattr(client, 'model', None), 
+            getattr(client, 'temperature', None), 
+            getattr(serializer, 'format', None), 
+            getattr(owner, 'data_error_standart', None)
+        ]
+        return hashlib.sha256(json.dumps(config, ensure_ascii=False, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+    def chunk_key(self, chunk: pd.DataFrame, config: str = "") -> str: 
+        """ Отпечаток порции: настройки этапа, колонки, индекс и значения строк. 
+            Индекс входит в отпечаток, потому что результаты порции привязаны к индексу её строк
+        """
+        digest = hashlib.sha256(config.encode('utf-8'))
+        digest.update('|'.join(map(str, chunk.columns)).encode('utf-8'))
+        digest.update(pd.util.hash_pandas_object(chunk, index=True).to_numpy().tobytes())
+        return digest.hexdigest()
+
+    def get(self, stage: str, key: str): 
+        with self.lock:
+            row = self.connection.execute("SELECT result FROM chunk_checkpoint WHERE stage = ? AND chunk_key = ?", (stage, key)).fetchone()
+            if row is not None:
+                self.hits += 1
+        # Результаты порций содержат DataFrame, поэтому храним их pickle, хранилище локальное
+        return pickle.loads(row[0]) if row is not None else None
+
+    def set(self, stage: str, key: str, result): 
+        payload = pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL)
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO chunk_checkpoint (stage, chunk_key, result, created_at) VALUES (?, ?, ?, ?)", 
+                (stage, key, payload, time.time())
+            )
+            self.connection.commit()
+            self.writes += 1
+
+    async def run(self, stage: str, chunk: pd.DataFrame, process, config: str = ""): 
+        """ Результат порции из контрольной точки, иначе обрабатываем порцию и сохраняем результат """
+        key = self.chunk_key(chunk, config)
+        result = self.get(stage, key)
+        if result is not None:
+            return result
+
+        result = await process(chunk)
+        self.set(stage, key, result)
+        return result
+
+    def stats(self) -> dict: 
+        """ Сколько порций взято из контрольных точек и сколько сохранено в этом запуске """
+        with self.lock:
+            entries = self.connection.execute("SELECT COUNT(*) FROM chunk_checkpoint").fetchone()[0]
+        return {"resumed_chunks": self.hits, "saved_chunks": self.writes, "entries": entries}
+
+    def close(self): 
+        with self.lock:
+            self.connection.close()
+
+
+class PartialOutputWriter:
+    """ Частичные результаты запуска: результат каждого батча пишется отдельным файлом 
+        directory/<этап>/part-00000.csv сразу после обработки батча. 
+        Файлы и манифест _manifest.json записываются во временный файл и переименовываются (os.replace), 
+        поэтому загрузка может читать готовые части по манифесту до окончания запуска и не увидит недописанный файл. 
+        По окончании запуска создается пустой файл _SUCCESS. 
+        При resume=True части прошлого запуска из манифеста остаются опубликованными, пока их не заменят новые
+    """
+
+    MANIFEST = "_manifest.json"
+    SUCCESS = "_SUCCESS"
+
+    def __init__(self, directory: str = "quality_output", format: str = "csv", resume: bool = False): 
+        self.directory = directory
+        # csv или parquet (нужен pyarrow)
+        self.format = format
+        self.resume = resume
+        self.parts = []
+
+    def read_parts(self) -> list: 
+        """ Части прошлого запуска из манифеста, файлы которых на месте """
+        path = os.path.join(self.directory, self.MANIFEST)
+        if not os.path.exists(path):
+            return []
+        with open(path, encoding='utf-8') as file:
+            parts = json.load(file).get("parts", [])
+        return [part for part in parts if os.path.exists(os.path.join(self.directory, part["path"]))]
+
+    def start(self): 
+        """ Начинаем запуск: без resume части прошлого запуска удаляются и манифест пустой, 
+            с resume остаются части из манифеста, а удаляются только файлы вне его (например, недописанные .tmp)
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        self.parts = self.read_parts() if self.resume else []
+        published = {os.path.normpath(part["path"]) for part in self.parts}
+
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if os.path.isdir(path):
+                for part in os.listdir(path):
+                    if part.startswith("part-") and os.path.normpath(os.path.join(name, part)) not in published:
+                        os.remove(os.path.join(path, part))
+        if os.path.exists(os.path.join(self.directory, self.SUCCESS)):
+            os.remove(os.path.join(self.directory, self.SUCCESS))
+        self.write_manifest()
+
+    def write_manifest(self, complete: bool = False): 
+        """ Манифест пишем во временный файл и переименовываем """
+        path = os.path.join(self.directory, self.MANIFEST)
+        with open(path + ".tmp", 'w', encoding='utf-8') as file:
+            json.dump({"parts": self.parts, "complete": complete}, file, ensure_ascii=False, indent=2)
+        os.replace(path + ".tmp", path)
+
+    def write(self, stage: str, batch_number: int, frame: pd.DataFrame) -> str: 
+        """ Записываем результат этапа по одному батчу и добавляем его в манифест """
+        os.makedirs(os.path.join(self.directory, stage), exist_ok=True)
+        path = os.path.join(self.directory, stage, f"part-{batch_number:05d}.{self.format}")
+
+        # Часть пишем во временный файл и переименовываем: читатель видит либо готовый файл, либо никакого
+        if self.format == "parquet":
+            frame.to_parquet(path + ".tmp", index=False)
+        else:
+            frame.to_csv(path + ".tmp", index=False)
+        os.replace(path + ".tmp", path)
+
+        # Часть, уже опубликованная прошлым запуском, заменяется в манифесте
+        self.parts = [part for part in self.parts if (part["stage"], part["batch"]) != (stage, batch_number)]
+        self.parts.append({"stage": stage, "batch": batch_number, "path": os.path.relpath(path, self.directory), "rows": len(frame)})
+        self.write_manifest()
+        return path
+
+    def finish(self): 
+        """ Запуск завершен: отмечаем манифест и создаем _SUCCESS """
+        self.write_manifest(complete=True)
+        open(os.path.join(self.directory, self.SUCCESS), 'w').close()
+
+
+class AsyncGigaChatClient:
+    """ Общий асинхронный клиент GigaChat API: пул соединений, 
+        ограничение одновременных запросов, частоты запросов и повторы при 429/5xx
+    """
+
+    API_URL = "https://gigachat.devices.sberbank.ru/api/v1/chat/completions"
+    RETRY_STATUSES = {429, 500, 502, 503, 504}
+    # GigaChat принимает только положительную температуру, поэтому детерминированный режим ставит минимальную
+    DETERMINISTIC_TEMPERATURE = 0.01
+
+    def __init__(self, token_provider: "TokenProvider" = None, max_concurrency: int = 8, requests_per_second: float = 5.0, 
+                 max_retries: int = 4, backoff: float = 1.0, timeout: float = 120.0, model: str = "GigaChat", temperature: float = 0.7, 
+                 cache: ResponseCache = None, deterministic: bool = False, stream: bool = False, api_url: str = None):
+        self.token_provider = token_provider or TokenProvider()
+        # Адрес API можно переопределить, например, для запуска на локальном тестовом сервере
+        self.api_url = api_url or os.environ.get('GIGACHAT_API_URL', self.API_URL)
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.model = model
+        self.temperature = self.DETERMINISTIC_TEMPERATURE if deterministic else temperature
+        # Повторные одинаковые промпты берутся из кэша без обращения к сети
+        self.cache = cache
+        # В потоковом режиме ответ приходит фрагментами (server-sent events) и разбирается по мере поступления
+        self.stream = stream
+
+        # Одна сессия на все агенты: TLS соединения переиспользуются между запросами
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_concurrency)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrency)
+        self.rate_limiter = TokenBucket(rate=requests_per_second, capacity=max_concurrency)
+        self._loop = None
+        self._semaphore = None
+        # Расход токенов по ответам API (поле usage), без учета ответов из кэша
+        self.usage = {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+
+    def get_semaphore(self) -> asyncio.Semaphore:
+        """ Семафор привязан к циклу событий, поэтому создаем его заново для каждого asyncio.run """
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+
+    def get_retry_delay(self, response: requests.Response, attempt: int) -> float:
+        """ Считаем паузу перед повтором: Retry-After от сервера или экспоненциальная задержка """
+        retry_after = response.headers.get('Retry-After') if response is not None else None
+        if retry_after and retry_after.isdigit():
+            return float(retry_after)
+        return self.backoff * 2 ** attempt + random.uniform(0, self.backoff)
+
+    def build_messages(self, message: str, system: str = None) -> list:
+        """ Собираем сообщения запроса: общее системное сообщение и промпт """
+        messages = [{"role": "user", "content": message}]
+        if system is not None:
+            messages.insert(0, {"role": "system", "content": system})
+        return messages
+
+    def post_chat(self, messages: list) -> tuple:
+        """ Синхронная отправка запроса через общий пул соединений, возвращаем использованный токен и ответ """
+        token = self.token_provider.get_token()
+        headers = {
+            'Content-Type': 'application/json',
+            'Authorization': f'Bearer {token}'
+        }
+
+        data = {
+            "model": self.model,
+            "messages": messages,
+            "temperature": self.temperature, 
+            "stream": self.stream
+        }
+
+        response = self.session.post(self.api_url, headers=headers, json=data, verify=False, timeout=self.timeout, stream=self.stream)
+        return token, response
+
+    def read_stream(self, response: requests.Response, on_delta=None) -> dict:
+        """ Читаем потоковый ответ: каждый фрагмент передаем в on_delta, 
+            из фрагментов собираем ответ в том же виде, что и без потока
+        """
+        parts = []
+        usage = {}
+        with response:
+            # Строки декодируем сами: decode_unicode в iter_lines может разрезать многобайтовый символ
+            for line in response.iter_lines():
+                line = line.decode('utf-8')
+                if not line or not line.startswith('data:'):
+                    continue
+                payload = line[len('data:'):].strip()
+                if payload == '[DONE]':
+                    break
+
+                event = json.loads(payload)
+                # Расход токенов приходит в последнем фрагменте потока
+                usage = event.get('usage') or usage
+                choices = event.get('choices') or [{}]
+                delta = choices[0].get('delta', {}).get('content') or ''
+                parts.append(delta)
+                if delta and on_delta is not None:
+                    on_delta(delta)
+
+        return {"choices": [{"message": {"role": "assistant", "content": ''.join(parts)}}], "usage": usage}
+
+    def count_usage(self, response: dict):
+        """ Добавляем расход токенов из ответа API к общим счетчикам """
+        usage = response.get('usage') or {}
+        self.usage["calls"] += 1
+        for field in ("prompt_tokens", "completion_tokens", "total_tokens"):
+            self.usage[field] += int(usage.get(field) or 0)
+
+    async def chat(self, message: str, system: str = None, on_delta=None, refresh: bool = False) -> dict:
+        """ Отправка запроса к GigaChat API с ограничениями и повторами. 
+            on_delta получает текст ответа фрагментами в потоковом режиме или целиком без него, 
+            refresh - не брать ответ из кэша, а запросить заново
+        """
+        messages = self.build_messages(message=message, system=system)
+
+        with TELEMETRY.span("gigachat.chat", prompt_chars=sum(len(item["content"]) for item in messages), cache_hit=0, retries=0) as span:
+            cache_key = None
+            if self.cache is not None:
+                cache_key = self.cache.make_key(self.model, self.temperature, messages)
+                cached_response = self.cache.get(cache_key) if not refresh else None
+                if cached_response is not None:
+                    span["cache_hit"] = 1
+                    span["completion_chars"] = len(cached_response['choices'][0]['message']['content'])
+                    if on_delta is not None:
+                        on_delta(cached_response['choices'][0]['message']['content'])
+                    return cached_response
+
+            response = await self.send_chat(messages=messages, on_delta=on_delta, span=span)
+
+            span["completion_chars"] = len(response['choices'][0]['message']['content'])
+            for field in ("prompt_tokens", "completion_tokens", "total_tokens"):
+                span[field] = int((response.get('usage') or {}).get(field) or 0)
+
+            if cache_key is not None:
+                self.cache.set(cache_key, response)
+
+        return response
+
+    async def send_chat(self, messages: list, on_delta=None, span: dict = None) -> dict:
+        """ Отправка запроса к GigaChat API через сеть, в span записывается число повторов """
+        span = span if span is not None else {}
+        loop = asyncio.get_running_loop()
+        attempt = 0
+        auth_retried = False
+
+        async with self.get_semaphore():
+            while True:
+                await self.rate_limiter.acquire()
+
+                try:
+                    # Контекст передаем в поток пула, чтобы замеры внутри запроса (например, получение токена) попали в текущий спан
+                    with TELEMETRY.span("gigachat.http") as http_span:
+                        token, response = await loop.run_in_executor(self.executor, contextvars.copy_context().run, self.post_chat, messages)
+                        http_span["status"] = response.status_code
+                except (requests.ConnectionError, requests.Timeout):
+                    if attempt == self.max_retries:
+                        raise
+                    await asyncio.sleep(self.get_retry_delay(None, attempt))
+                    attempt += 1
+                    span["retries"] = span.get("retries", 0) + 1
+                    continue
+
+                # В потоковом режиме тело ответа с ошибкой не читается, поэтому соединение освобождаем явно
+                if response.status_code != 200:
+                    response.close()
+
+                # Токен истек раньше ожидаемого: обновляем его и повторяем запрос один раз
+                if response.status_code == 401 and not auth_retried:
+                    self.token_provider.invalidate(token)
+                    auth_retried = True
+                    span["retries"] = span.get("retries", 0) + 1
+                    continue
+
+                if response.status_code in self.RETRY_STATUSES and attempt < self.max_retries:
+                    await asyncio.sleep(self.get_retry_delay(response, attempt))
+                    attempt += 1
+                    span["retries"] = span.get("retries", 0) + 1
+                    continue
+
+                if response.status_code != 200:
+                    raise Exception(f"Ошибка запроса к GigaChat API: {response.status_code}")
+
+                if not self.stream:
+                    result = response.json()
+                    if on_delta is not None:
+                        on_delta(result['choices'][0]['message']['content'])
+                else:
+                    # Фрагменты читаются в потоке пула, а обработчик вызывается в цикле событий
+                    emit = (lambda delta: loop.call_soon_threadsafe(on_delta, delta)) if on_delta is not None else None
+                    with TELEMETRY.span("gigachat.stream"):
+                        result = await loop.run_in_executor(self.executor, self.read_stream, response, emit)
+
+                self.count_usage(result)
+                return result
+
+    def chat_sync(self, message: str, system: str = None) -> dict:
+        """ Синхронная обертка над chat для вызова вне цикла событий """
+        return asyncio.run(self.chat(message=message, system=system))
+
+    def close(self):
+        """ Закрываем пул соединений и потоков """
+        self.executor.shutdown(wait=True)
+        self.session.close()
+
+
 class AiModelClient: 
     """ Клиент по взаимодействию с LLM моделью GigaChat """
 
     BASE_URL = "https://ngw.devices.sberbank.ru:9443/api/v2/oauth"
 
+    def __init__(self, base_url: str = None, timeout: float = 30.0): 
+        # Адрес сервиса авторизации можно переопределить, например, для локального тестового сервера
+        self.base_url = base_url or os.environ.get('GIGACHAT_AUTH_URL', self.BASE_URL)
+        # Токен запрашивается под блокировкой TokenProvider: зависший запрос не должен держать всех ожидающих
+        self.timeout = timeout
+
     def create_model(self) -> str:
         """ Создаем экземпляр класса для работы с моделями GigaChat """
 
@@ -52,8 +1934,8 @@ class AiModelClient:
         
         return giga 
     
-    def get_token_auth(self) -> str: 
-        """ Получаем токен доступа для отправки запросов """
+    def request_token(self) -> dict: 
+        """ Запрашиваем новый токен доступа вместе со сроком его действия """
         rqUID = uuid.uuid4()
         headers = {
             'Content-Type': 'application/x-www-form-urlencoded',
@@ -66,77 +1948,311 @@ class AiModelClient:
             'scope': 'GIGACHAT_API_PERS',
         }
 
-        response = requests.post('https://ngw.devices.sberbank.ru:9443/api/v2/oauth', headers=headers, data=data, verify=False)
+        response = requests.post(self.base_url, headers=headers, data=data, verify=False, timeout=self.timeout)
         if response.status_code == 200:
-            return response.json()['access_token']
+            return response.json()
         else: 
             raise Exception(f"Ошибка получения токена: {response.status_code}")
-        
 
-class PrecisionAiAgent:
+    def get_token_auth(self) -> str: 
+        """ Получаем токен доступа для отправки запросов """
+        return self.request_token()['access_token']
+
+
+class TokenProvider:
+    """ Кэш токена доступа GigaChat: обновляет токен заранее, до истечения срока действия.
+        Обновление выполняется под блокировкой, поэтому одновременные запросы не получают новый токен каждый сам по себе
+    """
+
+    # GigaChat выдает токен на 30 минут, если срок не пришел в ответе
+    DEFAULT_LIFETIME = 30 * 60
+
+    def __init__(self, model_client: AiModelClient = None, refresh_margin: float = 60.0): 
+        self.model_client = model_client or AiModelClient()
+        # За сколько секунд до истечения срока токен считается устаревшим
+        self.refresh_margin = refresh_margin
+        self.access_token = None
+        self.expires_at = 0.0
+        self.lock = threading.Lock()
+
+    def is_fresh(self) -> bool: 
+        """ Проверяем, что токен есть и не истечет в ближайшее время """
+        return self.access_token is not None and time.time() < self.expires_at - self.refresh_margin
+
+    @TELEMETRY.trace("oauth.token")
+    def refresh(self): 
+        """ Получаем новый токен и запоминаем срок его действия """
+        token_data = self.model_client.request_token()
+        self.access_token = token_data['access_token']
+        # expires_at приходит в миллисекундах unix времени
+        if token_data.get('expires_at'):
+            self.expires_at = token_data['expires_at'] / 1000
+        else:
+            self.expires_at = time.time() + self.DEFAULT_LIFETIME
+
+    def get_token(self) -> str: 
+        """ Возвращаем действующий токен, при необходимости обновляя его """
+        if self.is_fresh():
+            return self.access_token
+
+        with self.lock:
+            # Пока ждали блокировку, токен мог обновить другой поток
+            if not self.is_fresh():
+                self.refresh()
+            return self.access_token
+
+    def invalidate(self, token: str): 
+        """ Помечаем токен недействительным после ответа 401 """
+        with self.lock:
+            # Сбрасываем только тот токен, с которым пришел отказ, а не уже обновленный
+            if self.access_token == token:
+                self.expires_at = 0.0
+
+
+class RowVerdictRequester:
+    """ Запрос построчных вердиктов у модели: строки разбираются из ответа по мере поступления 
+        и проверяются по схеме, повторно отправляются только пропущенные или некорректные строки
+    """
+
+    def __init__(self, client: AsyncGigaChatClient, serializer: PromptSerializer = None, max_row_retries: int = 2): 
+        self.client = client
+        self.serializer = serializer or PromptSerializer()
+        self.max_row_retries = max_row_retries
+
+    @TELEMETRY.trace("rows.request")
+    async def request(self, chunk: pd.DataFrame, build_prompt, schema: RowSchema, system: str = DATASET_GLOSSARY, 
+                      contents: list = None) -> pd.DataFrame: 
+        """ Возвращаем типизированные вердикты по строкам порции в её порядке, 
+            строки без корректного ответа после всех повторов остаются пустыми. 
+            Строки с повторяющимся в порции student_id по ответу не различить, поэтому k-е повторы 
+            отправляются отдельным запросом. В contents, если передан, складываются полные тексты ответов
+        """
+        keys = chunk['student_id'].map(RowSchema.row_key)
+        # Строки без student_id сопоставить с ответом нельзя, в модель их не отправляем
+        keys = keys[keys.notna()]
+        occurrence = keys.groupby(keys, sort=False).cumcount()
+
+        row_verdicts = {}
+        for level in sorted(occurrence.unique()):
+            level_keys = keys[occurrence == level]
+            verdicts = await self.request_rows(chunk.loc[level_keys.index], level_keys, build_prompt, schema, system, contents)
+            row_verdicts.update({index: verdicts[key] for index, key in level_keys.items() if key in verdicts})
+
+        result = schema.empty_frame(chunk.index)
+        for field in schema.columns:
+            values = pd.Series({index: row[field] for index, row in row_verdicts.items()}, index=chunk.index, dtype=object)
+            result[field] = values.astype(result[field].dtype)
+        return result
+
+    async def request_rows(self, rows: pd.DataFrame, keys: pd.Series, build_prompt, schema: RowSchema, system: str, 
+                           contents: list) -> dict: 
+        """ Запрашиваем строки с различными student_id, повторяя только пропущенные, результат - {ключ строки: вердикт} """
+        verdicts = {}
+        pending = rows
+
+        for attempt in range(self.max_row_retries + 1):
+            if pending.empty:
+                break
+
+            parser = StreamingRowParser()
+            expected = set(keys.loc[pending.index])
+
+            def collect(text: str):
+                for row in parser.feed(text):
+                    row = schema.validate(row)
+                    if row is not None and row['student_id'] in expected:
+                        verdicts[row['student_id']] = row
+
+            try:
+                # Повторный запрос с тем же набором строк не должен вернуть тот же ответ из кэша
+                response = await self.client.chat(
+                    message=build_prompt(self.serializer.serialize(pending)), system=system, on_delta=collect, refresh=attempt > 0
+                )
+            except requests.RequestException:
+                # Поток оборвался: строки, пришедшие до обрыва, уже сохранены, повторяем только остальные
+                response = None
+
+            if contents is not None and response is not None:
+                contents.append(response['choices'][0]['message']['content'])
+
+            pending = pending[~keys.loc[pending.index].isin(verdicts.keys())]
+
+        return verdicts
+
+
+class QualityAgent:
+    """ Общая часть ИИ агентов по параметрам качества: клиент GigaChat, сериализация и порции строк, 
+        состояние между запусками, контрольные точки и потоковый проход по батчам источника. 
+        Наследник задает STATE_KEY, process_batch и acreate_agent_chain, синхронный create_agent_chain общий. 
+        Построчные результаты в памяти не накапливаются: по батчам копятся только сумма и число оценок, 
+        а строки при необходимости пишутся частями в PartialOutputWriter
+    """
+
+    STATE_KEY = None
+
+    def __init__(self, chunker: DatasetChunker = None, client: AsyncGigaChatClient = None, state: IncrementalState = None, 
+                 data_source: DataSourceClient = None, serializer: PromptSerializer = None, checkpoints: CheckpointStore = None): 
+        self.serializer = serializer or PromptSerializer()
+        self.chunker = chunker or DatasetChunker(serializer=self.serializer)
+        self.aggregator = ChunkResultAggregator()
+        self.client = client or AsyncGigaChatClient()
+        self.requester = RowVerdictRequester(client=self.client, serializer=self.serializer)
+        # Если задано состояние, оцениваются только новые и измененные строки
+        self.state = state
+        self.data_source = data_source or DataSourceClient()
+        # Если заданы контрольные точки, готовые порции строк при возобновлении запуска не отправляются в модель
+        self.checkpoints = checkpoints
+        # Дата запуска для промптов фиксируется один раз, при возобновлении берется из контрольных точек
+        self.run_date = checkpoints.run_date if checkpoints is not None else pd.Timestamp.now().strftime('%Y-%m-%d')
+
+    @staticmethod
+    def select_changed(state: IncrementalState, state_key: str, dataset: pd.DataFrame) -> tuple: 
+        """ В инкрементальном режиме оцениваем только новые и измененные строки: 
+            возвращаем изменения по состоянию (None без состояния), маску строк для оценки и сами строки
+        """
+        changes = state.diff(state_key, dataset) if state is not None else None
+        changed = changes["changed"] if changes is not None else np.ones(len(dataset), dtype=bool)
+        return changes, changed, dataset[changed]
+
+    async def aiter_batch_results(self, output: PartialOutputWriter = None): 
+        """ Потоково оцениваем датасет: батч читается, оценивается и отдается дальше, не накапливаясь в памяти. 
+            Если задан output, результат каждого батча сразу пишется отдельной частью
+        """
+        if self.state is not None:
+            self.state.start_run(self.STATE_KEY)
+        if output is not None:
+            output.start()
+
+        for batch_number, batch in enumerate(self.data_source.iter_batches()):
+            batch_result = await self.process_batch(batch)
+            if output is not None:
+                output.write(self.STATE_KEY, batch_number, self.aggregator.batch_rows(batch, batch_result))
+            yield batch_result
+
+        if self.state is not None:
+            self.state.finish_run(self.STATE_KEY)
+        if output is not None:
+            output.finish()
+
+    async def ascore(self, output: PartialOutputWriter = None, on_batch=None) -> float: 
+        """ Оценка по датасету - среднее построчных оценок, по батчам копятся только сумма и число оценок. 
+            on_batch, если задан, получает результат каждого батча
+        """
+        score_sum, score_count = 0.0, 0
+        async for batch_result in self.aiter_batch_results(output=output):
+            row_scores = self.aggregator.batch_row_scores(batch_result)
+            score_sum += float(np.nansum(row_scores))
+            score_count += int(np.count_nonzero(~np.isnan(row_scores)))
+            if on_batch is not None:
+                on_batch(batch_result)
+
+        if self.state is not None:
+            return self.state.dataset_score(self.STATE_KEY)
+        return score_sum / score_count if score_count else None
+
+    def create_agent_chain(self, output: PartialOutputWriter = None) -> dict: 
+        """ Синхронный запуск acreate_agent_chain """
+        return asyncio.run(self.acreate_agent_chain(output=output))
+
+
+class RuleScreenedAgent(QualityAgent):
+    """ Агент с предварительными проверками RuleEngine: строки, решенные правилами, в модель не отправляются """
+
+    def __init__(self, rule_engine: RuleEngine = None, partitioned: PartitionedExecutor = None, **agent_params): 
+        super().__init__(**agent_params)
+        self.rule_engine = rule_engine or RuleEngine()
+        # Если задан пул процессов, проверки правил выполняются по шардам батча параллельно
+        self.partitioned = partitioned
+
+    def screen_stage(self, dataset: pd.DataFrame) -> tuple: 
+        """ Этап проверки правил для PartitionedExecutor: средние считаются по всему батчу до деления на шарды """
+        return self.rule_engine.screen, {"means": self.rule_engine.robust_means(dataset)}
+
+    async def screen(self, dataset: pd.DataFrame) -> pd.DataFrame: 
+        """ Проверки правил по батчу, если задан пул процессов - по шардам параллельно """
+        function, params = self.screen_stage(dataset)
+        if self.partitioned is None:
+            return function(dataset, **params)
+        return (await self.partitioned.arun(dataset, {self.STATE_KEY: (function, params)}))[self.STATE_KEY]
+
+
+class ChunkScoredAgent(QualityAgent):
+    """ Агент, который ставит оценку порции строк целиком (полнота, своевременность): 
+        оценка порции переносится на её строки, комментарии модели собираются по порциям. 
+        Наследник задает STATE_KEY, SCORE_KEY и read_dataset_edtech_data_prompt
+    """
+
+    SCORE_KEY = None
+
+    @TELEMETRY.trace("chunk")
+    @CheckpointStore.checkpointed()
+    async def process_chunk(self, chunk: pd.DataFrame) -> tuple: 
+        """ Оцениваем одну порцию строк: оценка и комментарий модели """
+
+        data_edtech = self.serializer.serialize(chunk)
+
+        chunk_prompt = self.read_dataset_edtech_data_prompt(data_edtech=data_edtech)
+        chunk_data = self.aggregator.get_content(await self.client.chat(message=chunk_prompt, system=DATASET_GLOSSARY))
+
+        return self.aggregator.parse_score(chunk_data), chunk_data
+
+    @TELEMETRY.trace("batch")
+    async def process_batch(self, dataset: pd.DataFrame) -> dict: 
+        """ Оцениваем один батч, порции строк обрабатываются одновременно """
+
+        changes, changed, scored_data = self.select_changed(self.state, self.STATE_KEY, dataset)
+
+        chunks = self.chunker.split(scored_data)
+        chunk_results = await asyncio.gather(*[self.process_chunk(chunk=chunk) for chunk in chunks])
+        row_scores = self.aggregator.chunk_row_scores(scored_data, chunks, [score for score, _ in chunk_results])
+
+        if self.state is not None:
+            row_scores = self.state.update(self.STATE_KEY, changes, pd.DataFrame({'row_score': row_scores}), [])['row_score'].to_numpy()
+
+        return {
+            "row_scores": row_scores, 
+            "row_chunks": self.aggregator.chunk_row_ids(dataset, chunks), 
+            "comments": [comment for _, comment in chunk_results]
+        }
+
+    async def acreate_agent_chain(self, output: PartialOutputWriter = None) -> dict: 
+        """ Оцениваем датасет, построчные оценки батчей пишутся в output, комментарии модели собираются по порциям """
+
+        comments = []
+        score = await self.ascore(output=output, on_batch=lambda batch: comments.extend(batch["comments"]))
+
+        return {
+            self.SCORE_KEY: score, 
+            "comments": comments
+        }
+
+
+class PrecisionAiAgent(RuleScreenedAgent):
     """ ИИ агент для оценки точности данных """
 
-    def __init__(self): 
+    STATE_KEY = "precision"
+    CHECK_SCHEMA = RowSchema({'is_valid': (0, 1)})
+    SOLUTION_SCHEMA = RowSchema({'is_valid_gpt': (0, 1)})
+    VERDICT_SCHEMA = RowSchema({**CHECK_SCHEMA.fields, **SOLUTION_SCHEMA.fields})
+
+    def __init__(self, chunker: DatasetChunker = None, client: AsyncGigaChatClient = None, rule_engine: RuleEngine = None, 
+                 state: IncrementalState = None, data_source: DataSourceClient = None, serializer: PromptSerializer = None, 
+                 partitioned: PartitionedExecutor = None, checkpoints: CheckpointStore = None): 
         # Задаём норму отклонения для оценки точности данных для некоторых числовых переменных
         self.data_error_standart = { 
             "scholarship_amount": 1500, 
             "average_study_hours": 15, 
             "library_visits_per_month": 10
         }
+        super().__init__(
+            rule_engine=rule_engine or RuleEngine(data_error_standart=self.data_error_standart), partitioned=partitioned, 
+            chunker=chunker, client=client, state=state, data_source=data_source, serializer=serializer, checkpoints=checkpoints
+        )
 
-    def send_gigachat_request_precision(self, token: str, message: str) -> json:
+    def send_gigachat_request_precision(self, message: str) -> json:
         """Отправка запроса к GigaChat API"""
-        url = "https://gigachat.devices.sberbank.ru/api/v1/chat/completions"
-        
-        headers = {
-            'Content-Type': 'application/json',
-            'Authorization': f'Bearer {token}'
-        }
-        
-        data = {
-            "model": "GigaChat",
-            "messages": [
-                {
-                    "role": "user",
-                    "content": message
-                }
-            ],
-            "temperature": 0.7
-        }
-        
-        response = requests.post(url, headers=headers, json=data, verify=False)
-        return response.json()
-
-    def read_dataset_edtech_data_prompt(self, data_edtech: json) -> str: 
-        """ Отправляем промпт запрос на чтение датасета """
-
-        prompt_message = """ Читаем датасет данных о студентах. Датасет содержит поля: 
-            - student_id - уникальный идентификатор студента
-            - email - электронная почта студента
-            - phone_number - мобильный номер телефона студента
-            - date_of_birth - дата рождения студента
-            - age - возраст студента
-            - admission_year - год поступления в учебное заведение
-            - faculty - факультет, на котором учится студента
-            - group_name - наименование группы обучения
-            - gpa - средний балл студента 
-            - last_test_score -  балл за последний сданный экзамен или тест
-            - attendance_percent - процент посещаемости занятий
-            - scholarship_amount - размер стипендии в рублях
-            - extracurricular_activities - внеучебные активности
-            - on_probation - находится ли студент на академическом испытательном сроке 
-            - has_dormitory - проживает ли студент в общежитии
-            - enrollment_status - текущий статус обучения студента
-            - preferred_language - предпочитаемый язык для обучения или язык, на котором обучается студент
-            - mentor_id - идентификатор ментора
-            - average_study_hours - среднее количество часов, которое тратит на самостоятельное обучение студент
-            - library_visits_per_month - среднее количество посещений библиотеки в месяц
-       
-            Изучи датасет и верни "ОК", если ты изучил его.
-        """ + str(data_edtech)
+        return self.client.chat_sync(message=message, system=DATASET_GLOSSARY)
 
-        return prompt_message
- 
     def check_dataset_correct_prompt(self, data_edtech: json) -> str: 
         
         prompt_message = """ Проверяем датасет переданный ранее на корректность по следующим признакам: 
@@ -148,7 +2264,8 @@ class PrecisionAiAgent:
 
             Добавь в структуру новое поле "is_valid", если строка прошла валидацию по этим критерия, то верни 1, иначе 0
 
-            Верни обновленную структуру данных только в формате JSON, не возвращай больше ничего.
+            Верни только JSON список объектов с полями student_id и is_valid для каждой строки, не возвращай больше ничего.
+            Данные переданы в формате: """ + self.serializer.describe() + """.
         """ + str(data_edtech) + "data_error_standart = " + str(self.data_error_standart)
         
         return prompt_message
@@ -164,7 +2281,8 @@ class PrecisionAiAgent:
 
             Добавь новое поле is_valid_gpt и расставь эти значения для каждой строки. 
 
-            Верни JSON структуру, не добавляй больше в сообщение ничего.
+            Верни JSON список объектов с полями student_id и is_valid_gpt, не добавляй больше в сообщение ничего.
+            Данные переданы в формате: """ + self.serializer.describe() + """.
         """ + str(data_edtech)
         
         return prompt_message
@@ -183,69 +2301,79 @@ class PrecisionAiAgent:
 
         return prompt_message
 
-    def create_agent_chain(self, token: str) -> str: 
-        """ Запускаем всю цепочку обработки данных """
+    @TELEMETRY.trace("chunk")
+    @CheckpointStore.checkpointed(prompts=("check_dataset_correct_prompt", "add_solution_gpt", "get_accuracy_assessment"))
+    async def process_chunk(self, chunk: pd.DataFrame) -> dict: 
+        """ Обрабатываем одну порцию строк: независимые промпты отправляются одновременно """
 
-        ds = DataSourceClient()
-        data_edtech = ds.create_dataset()
-        data_edtech = ds.dataset_from_dataframe_to_json(dataset_edtech=data_edtech)
+        # Запросы к API не хранят контекст диалога, поэтому данные передаются в каждом промпте 
+        # и отдельный шаг изучения датасета не нужен
+        data_edtech = self.serializer.serialize(chunk)
+        get_accuracy_prompt = self.get_accuracy_assessment(data_edtech=data_edtech)
 
-        # Изучаем данные 
-        learning_data_prompt = self.read_dataset_edtech_data_prompt(data_edtech=data_edtech)
-        learning_data = self.send_gigachat_request_precision(token=token, message=learning_data_prompt)['choices'][0]['message']['content']
+        # Проверяем порцию по первому критерию, добавляем решение ии модели по каждой строке 
+        # и оцениваем точность порции - эти запросы не зависят друг от друга
+        checked_rows, solution_rows, accuracy_score = await asyncio.gather(
+            self.requester.request(chunk, self.check_dataset_correct_prompt, self.CHECK_SCHEMA), 
+            self.requester.request(chunk, self.add_solution_gpt, self.SOLUTION_SCHEMA), 
+            self.client.chat(message=get_accuracy_prompt, system=DATASET_GLOSSARY)
+        )
 
-        check_data_prompt = self.check_dataset_correct_prompt(data_edtech=data_edtech)
-        add_solution_gpt_prompt = self.add_solution_gpt(data_edtech=data_edtech)
-        get_accuracy_prompt = self.get_accuracy_assessment(data_edtech=data_edtech)
+        return {
+            "rows": pd.concat([checked_rows, solution_rows], axis=1), 
+            "accuracy_score": self.aggregator.parse_score(self.aggregator.get_content(accuracy_score))
+        }
 
-        if "ОК" in learning_data: 
+    @TELEMETRY.trace("batch")
+    async def process_batch(self, dataset: pd.DataFrame) -> pd.DataFrame: 
+        """ Оцениваем точность одного батча, порции строк обрабатываются одновременно """
 
-            # Проверяем датасет по первому критерию
-            checking_data = self.send_gigachat_request_precision(token=token, message=check_data_prompt)['choices'][0]['message']['content'] 
-            
-            # Добавляем решение ии модели оценки качества данных в каждой строке
-            add_solution_gpt = self.send_gigachat_request_precision(token=token, message=add_solution_gpt_prompt)['choices'][0]['message']['content'] 
+        changes, changed, scored_data = self.select_changed(self.state, self.STATE_KEY, dataset)
 
-            # Оцениваем точность, как параметр качества данных
-            accuracy_score = self.send_gigachat_request_precision(token=token, message=get_accuracy_prompt)['choices'][0]['message']['content']
+        # Строки, по которым правила вынесли однозначное решение, в модель не отправляем
+        screening = (await self.screen(dataset))[changed]
+        rule_verdict = screening["rule_verdict"].to_numpy()
+        chunks = self.chunker.split(scored_data[np.isnan(rule_verdict)])
 
-            print(accuracy_score)
+        chunk_results = await asyncio.gather(*[self.process_chunk(chunk=chunk) for chunk in chunks])
+        row_scores = self.aggregator.chunk_row_scores(scored_data, chunks, [result["accuracy_score"] for result in chunk_results], initial=rule_verdict)
 
-        else: 
-            print("Модель не смогла изучить переданный датасет")
+        processed_data = self.aggregator.join_verdicts(scored_data, [result["rows"] for result in chunk_results], self.VERDICT_SCHEMA)
+        # Правила решают только is_valid, is_valid_gpt - вердикт модели
+        processed_data = self.aggregator.apply_rule_verdicts(processed_data, rule_verdict, {'is_valid': 1}, {'is_valid': 0})
+        processed_data = self.aggregator.apply_rule_verdicts(processed_data, screening["deviation_verdict"].to_numpy(), {'is_valid': 1}, {'is_valid': 0})
+        processed_data['rule_violations'] = screening["rule_violations"].to_numpy()
+        processed_data['row_score'] = row_scores
+
+        if self.state is not None:
+            verdicts = self.state.update(self.STATE_KEY, changes, processed_data, ['is_valid', 'is_valid_gpt', 'rule_violations'])
+            processed_data = pd.concat([dataset.reset_index(drop=True), verdicts], axis=1)
+
+        # Оценка точности ставится порции целиком, номер порции нужен для оценки дисперсии по выборке
+        processed_data['row_chunk'] = self.aggregator.chunk_row_ids(dataset, chunks)
+        return processed_data
+
+    async def acreate_agent_chain(self, output: PartialOutputWriter = None) -> dict: 
+        """ Запускаем всю цепочку обработки данных, построчные результаты батчей пишутся в output """
+
+        accuracy_score = await self.ascore(output=output)
+
+        print(accuracy_score)
 
         return {
-            "checking_data_first_sign": checking_data,
-            "processed_data": add_solution_gpt, 
             "accuracy_score": accuracy_score
         }
 
 
-class FulnessAiAgent: 
+class FulnessAiAgent(ChunkScoredAgent): 
     """ ИИ агент для оценки полноты данных """
 
-    def send_gigachat_request_fulness(self, token: str, message: str) -> json:
+    STATE_KEY = "fulness"
+    SCORE_KEY = "fulness_score"
+
+    def send_gigachat_request_fulness(self, message: str) -> json:
         """Отправка запроса к GigaChat API"""
-        url = "https://gigachat.devices.sberbank.ru/api/v1/chat/completions"
-        
-        headers = {
-            'Content-Type': 'application/json',
-            'Authorization': f'Bearer {token}'
-        }
-        
-        data = {
-            "model": "GigaChat",
-            "messages": [
-                {
-                    "role": "user",
-                    "content": message
-                }
-            ],
-            "temperature": 0.7
-        }
-        
-        response = requests.post(url, headers=headers, json=data, verify=False)
-        return response.json()
+        return self.client.chat_sync(message=message, system=DATASET_GLOSSARY)
 
     def read_dataset_edtech_data_prompt(self, data_edtech: json) -> str: 
         """
@@ -255,28 +2383,7 @@ class FulnessAiAgent:
 
         prompt_message = """
             На вход ты получаешь датасет с образовательными данными о студентах. 
-
-            Поля в датасете следующие: 
-                - student_id - уникальный идентификатор студента
-                - email - электронная почта студента
-                - phone_number - мобильный номер телефона студента
-                - date_of_birth - дата рождения студента
-                - age - возраст студента
-                - admission_year - год поступления в учебное заведение
-                - faculty - факультет, на котором учится студента
-                - group_name - наименование группы обучения
-                - gpa - средний балл студента 
-                - last_test_score -  балл за последний сданный экзамен или тест
-                - attendance_percent - процент посещаемости занятий
-                - scholarship_amount - размер стипендии в рублях
-                - extracurricular_activities - внеучебные активности
-                - on_probation - находится ли студент на академическом испытательном сроке 
-                - has_dormitory - проживает ли студент в общежитии
-                - enrollment_status - текущий статус обучения студента
-                - preferred_language - предпочитаемый язык для обучения или язык, на котором обучается студент
-                - mentor_id - идентификатор ментора
-                - average_study_hours - среднее количество часов, которое тратит на самостоятельное обучение студент
-                - library_visits_per_month - среднее количество посещений библиотеки в месяц
+            Данные переданы в формате: """ + self.serializer.describe() + """.
 
             Оцени полноту данных. Данные являются полными, если сущность имеет достаточное кол-во атрибутов для анализа. 
             Здесь имеется ввиду, что все необходимые поля для этого присутствуют. Ненужно проверять корректность данных.
@@ -287,76 +2394,37 @@ class FulnessAiAgent:
 
         return prompt_message
 
-    def create_agent_chain(self, token: str) -> dict: 
-
-        ds = DataSourceClient()
-        data_edtech = ds.create_dataset()
-        data_edtech = ds.dataset_from_dataframe_to_json(dataset_edtech=data_edtech)
 
-        learning_data_prompt = self.read_dataset_edtech_data_prompt(data_edtech=data_edtech)
-        fulness_data = self.send_gigachat_request_fulness(token=token, message=learning_data_prompt)['choices'][0]['message']['content']
-
-        return fulness_data
+class ValidityAiAgent(RuleScreenedAgent):
+    """ ИИ агент для оценки достоверности данных """ 
 
+    STATE_KEY = "validity"
+    LABEL_SCHEMA = RowSchema({'is_valid': ['точный', 'похож на правду', 'не похож на правду']})
 
-class ValidityAiAgent:
-    """ ИИ агент для оценки достоверности данных """ 
+    def __init__(self, chunker: DatasetChunker = None, client: AsyncGigaChatClient = None, rule_engine: RuleEngine = None, 
+                 state: IncrementalState = None, data_source: DataSourceClient = None, serializer: PromptSerializer = None, 
+                 partitioned: PartitionedExecutor = None, checkpoints: CheckpointStore = None): 
+        # Для достоверности нормы отклонения не применяем: только диапазоны, форматы и даты
+        super().__init__(
+            rule_engine=rule_engine or RuleEngine(), partitioned=partitioned, 
+            chunker=chunker, client=client, state=state, data_source=data_source, serializer=serializer, checkpoints=checkpoints
+        )
 
-    def send_gigachat_request_validity(self, token: str, message: str) -> json:
+    def send_gigachat_request_validity(self, message: str) -> json:
         """Отправка запроса к GigaChat API"""
-        url = "https://gigachat.devices.sberbank.ru/api/v1/chat/completions"
-        
-        headers = {
-            'Content-Type': 'application/json',
-            'Authorization': f'Bearer {token}'
-        }
-        
-        data = {
-            "model": "GigaChat",
-            "messages": [
-                {
-                    "role": "user",
-                    "content": message
-                }
-            ],
-            "temperature": 0.7
-        }
-        
-        response = requests.post(url, headers=headers, json=data, verify=False)
-        return response.json()
+        return self.client.chat_sync(message=message, system=DATASET_GLOSSARY)
 
     def read_dataset_edtech_data_prompt(self, data_edtech: json) -> str: 
         """ Получаем промпт запрос для оценки достоверности данных """
         
         prompt_message = """
-            На вход ты получаешь датасет, который содержит следующие поля: 
-
-            - student_id - уникальный идентификатор студента
-            - email - электронная почта студента
-            - phone_number - мобильный номер телефона студента
-            - date_of_birth - дата рождения студента
-            - age - возраст студента
-            - admission_year - год поступления в учебное заведение
-            - faculty - факультет, на котором учится студента
-            - group_name - наименование группы обучения
-            - gpa - средний балл студента 
-            - last_test_score -  балл за последний сданный экзамен или тест
-            - attendance_percent - процент посещаемости занятий
-            - scholarship_amount - размер стипендии в рублях
-            - extracurricular_activities - внеучебные активности
-            - on_probation - находится ли студент на академическом испытательном сроке 
-            - has_dormitory - проживает ли студент в общежитии
-            - enrollment_status - текущий статус обучения студента
-            - preferred_language - предпочитаемый язык для обучения или язык, на котором обучается студент
-            - mentor_id - идентификатор ментора
-            - average_study_hours - среднее количество часов, которое тратит на самостоятельное обучение студент
-            - library_visits_per_month - среднее количество посещений библиотеки в месяц
+            На вход ты получаешь датасет о студентах в формате: """ + self.serializer.describe() + """.
 
             Для каждого поля оцени: возможен ли такой показатель исходя из текущей ситуации в образовании. 
             Добавь дополнительное поле is_valid в датасет и добавь туда одно из трех значений: точный, не похож 
             на правду, похож на правду. 
 
-            Верни измененный датасет, больше ничего не возвращай.  
+            Верни JSON список объектов с полями student_id и is_valid для каждой строки, больше ничего не возвращай.  
         """ + str(data_edtech)
 
         return prompt_message
@@ -373,49 +2441,729 @@ class ValidityAiAgent:
 
         return prompt_message
 
-    def create_agent_chain(self, token: str) -> dict: 
-        """ Создаем цепочку вызовов """
+    @TELEMETRY.trace("chunk")
+    @CheckpointStore.checkpointed()
+    async def process_chunk(self, chunk: pd.DataFrame) -> tuple: 
+        """ Размечаем одну порцию строк и оцениваем её достоверность """
 
-        ds = DataSourceClient()
-        data_edtech = ds.create_dataset()
-        data_edtech = ds.dataset_from_dataframe_to_json(dataset_edtech=data_edtech)    
+        # Размечаем строки
+        labels = await self.requester.request(chunk, self.read_dataset_edtech_data_prompt, self.LABEL_SCHEMA)
 
-        # Изучаем данные 
-        learning_data_prompt = self.read_dataset_edtech_data_prompt(data_edtech=data_edtech)
-        learning_data = self.send_gigachat_request_validity(token=token, message=learning_data_prompt)['choices'][0]['message']['content']
-
-        # Оцениваем достоверность данных
+        # Оцениваем достоверность размеченной порции
+        learning_data = self.serializer.serialize(chunk.assign(is_valid=labels['is_valid'].astype(object)))
         validity_score_prompt = self.get_validity_assessment(data_edtech=learning_data)
-        validity_score = self.send_gigachat_request_validity(token=token, message=validity_score_prompt)['choices'][0]['message']['content']
+        validity_score = self.aggregator.get_content(await self.client.chat(message=validity_score_prompt, system=DATASET_GLOSSARY))
+
+        return labels, self.aggregator.parse_score(validity_score)
+
+    @TELEMETRY.trace("batch")
+    async def process_batch(self, dataset: pd.DataFrame) -> pd.DataFrame: 
+        """ Размечаем один батч, порции строк обрабатываются одновременно """
+
+        changes, changed, scored_data = self.select_changed(self.state, self.STATE_KEY, dataset)
+
+        # Строки, по которым правила вынесли однозначное решение, в модель не отправляем
+        screening = (await self.screen(dataset))[changed]
+        rule_verdict = screening["rule_verdict"].to_numpy()
+        chunks = self.chunker.split(scored_data[np.isnan(rule_verdict)])
+
+        chunk_results = await asyncio.gather(*[self.process_chunk(chunk=chunk) for chunk in chunks])
+        row_scores = self.aggregator.chunk_row_scores(scored_data, chunks, [score for _, score in chunk_results], initial=rule_verdict)
+
+        learning_data = self.aggregator.join_verdicts(scored_data, [labels for labels, _ in chunk_results], self.LABEL_SCHEMA)
+        learning_data = self.aggregator.apply_rule_verdicts(learning_data, rule_verdict, {'is_valid': 'точный'}, {'is_valid': 'не похож на правду'})
+        learning_data['rule_violations'] = screening["rule_violations"].to_numpy()
+        learning_data['row_score'] = row_scores
+
+        if self.state is not None:
+            verdicts = self.state.update(self.STATE_KEY, changes, learning_data, ['is_valid', 'rule_violations'])
+            learning_data = pd.concat([dataset.reset_index(drop=True), verdicts], axis=1)
+
+        # Оценка достоверности ставится порции целиком, номер порции нужен для оценки дисперсии по выборке
+        learning_data['row_chunk'] = self.aggregator.chunk_row_ids(dataset, chunks)
+        return learning_data
+
+    async def acreate_agent_chain(self, output: PartialOutputWriter = None) -> dict: 
+        """ Создаем цепочку вызовов, размеченные строки батчей пишутся в output """
+
+        validity_score = await self.ascore(output=output)
 
         return {
-            "learning_data": learning_data, 
             "validity_score": validity_score
         }
 
 
+class ConsistencyAiAgent(QualityAgent):
+    """ ИИ агент для оценки согласованности данных """
+
+    STATE_KEY = "consistency"
+    ROW_SCHEMA = RowSchema({'is_consistent': (0, 1)})
+
+    def __init__(self, chunker: DatasetChunker = None, client: AsyncGigaChatClient = None, state: IncrementalState = None, 
+                 data_source: DataSourceClient = None, serializer: PromptSerializer = None, index: ConsistencyIndex = None, 
+                 partitioned: PartitionedExecutor = None, checkpoints: CheckpointStore = None): 
+        super().__init__(chunker=chunker, client=client, state=state, data_source=data_source, serializer=serializer, checkpoints=checkpoints)
+        # Индекс межстрочной согласованности: жесткие нарушения решаются без модели, остальное передается признаками
+        self.index = index
+        # Если задан пул процессов, признаки индекса считаются по шардам батча параллельно
+        self.partitioned = partitioned
+
+    def read_dataset_edtech_data_prompt(self, data_edtech: json) -> str: 
+        """ Получаем промпт запрос для оценки согласованности данных """
+
+        prompt_message = """
+            На вход ты получаешь датасет о студентах в формате: """ + self.serializer.describe() + """.
+
+            Оцени согласованность данных: не противоречат ли значения полей строки друг другу и другим строкам. 
+            Например: возраст и дата рождения, год поступления и возраст, наименование группы и факультет, 
+            испытательный срок и средний балл, повторяющиеся student_id или email у разных студентов.
+
+            Добавь поле is_consistent: 1 - строка согласована, 0 - в строке есть противоречия.
+
+            Верни JSON список объектов с полями student_id и is_consistent для каждой строки, больше ничего не возвращай.
+        """ + str(data_edtech)
+
+        return prompt_message
+
+    def features_stage(self) -> tuple: 
+        """ Этап признаков индекса для PartitionedExecutor, индекс строится по всему источнику при первом обращении """
+        if not self.index.built:
+            self.index.build(self.data_source)
+        return self.index.features, {}
+
+    async def anomaly_features(self, dataset: pd.DataFrame) -> pd.DataFrame: 
+        """ Признаки аномалий по строкам батча """
+        if self.index is None:
+            return None
+        function, params = self.features_stage()
+        if self.partitioned is None:
+            return function(dataset, **params)
+        return (await self.partitioned.arun(dataset, {self.STATE_KEY: (function, params)}))[self.STATE_KEY]
+
+    @TELEMETRY.trace("chunk")
+    @CheckpointStore.checkpointed()
+    async def process_chunk(self, chunk: pd.DataFrame) -> pd.DataFrame: 
+        """ Размечаем согласованность одной порции строк """
+        return await self.requester.request(chunk, self.read_dataset_edtech_data_prompt, self.ROW_SCHEMA)
+
+    @TELEMETRY.trace("batch")
+    async def process_batch(self, dataset: pd.DataFrame) -> pd.DataFrame: 
+        """ Оцениваем согласованность одного батча, порции строк обрабатываются одновременно """
+
+        # Признаки аномалий передаются модели колонкой anomalies и входят в отпечаток строки: 
+        # если у строки появился дубль в другом месте таблицы, она оценивается заново
+        features = await self.anomaly_features(dataset)
+        if features is not None:
+            dataset_features = dataset.assign(anomalies=features['anomalies'].to_numpy())
+            index_verdict = features['index_verdict'].to_numpy()
+        else:
+            dataset_features = dataset
+            index_verdict = np.full(len(dataset), np.nan)
+
+        changes, changed, scored_data = self.select_changed(self.state, self.STATE_KEY, dataset_features)
+        index_verdict = index_verdict[changed]
+
+        # Строки с жесткими нарушениями по индексу в модель не отправляем
+        chunks = self.chunker.split(scored_data[np.isnan(index_verdict)])
+        chunk_results = await asyncio.gather(*[self.process_chunk(chunk=chunk) for chunk in chunks])
+
+        consistency_data = self.aggregator.join_verdicts(scored_data, chunk_results, self.ROW_SCHEMA)
+        consistency_data = self.aggregator.apply_rule_verdicts(consistency_data, index_verdict, {'is_consistent': 1}, {'is_consistent': 0})
+        consistency_data['index_violations'] = features['index_violations'].to_numpy()[changed] if features is not None else ''
+        consistency_data['row_score'] = consistency_data['is_consistent'].to_numpy()
+
+        if self.state is not None:
+            verdicts = self.state.update(self.STATE_KEY, changes, consistency_data, ['is_consistent', 'index_violations'])
+            consistency_data = pd.concat([dataset.reset_index(drop=True), verdicts], axis=1)
+
+        return consistency_data
+
+    async def acreate_agent_chain(self, output: PartialOutputWriter = None) -> dict: 
+        """ Оцениваем согласованность данных, построчные вердикты батчей пишутся в output """
+
+        consistency_score = await self.ascore(output=output)
+
+        return {
+            "consistency_score": consistency_score
+        }
+
+
+class TimelinessAiAgent(ChunkScoredAgent): 
+    """ ИИ агент для оценки своевременности данных """
+
+    STATE_KEY = "timeliness"
+    SCORE_KEY = "timeliness_score"
+
+    def read_dataset_edtech_data_prompt(self, data_edtech: json) -> str: 
+        """ Получаем промпт запрос для оценки своевременности данных """
+
+        prompt_message = """
+            На вход ты получаешь датасет о студентах в формате: """ + self.serializer.describe() + """.
+            Сегодняшняя дата: """ + self.run_date + """.
+
+            Оцени своевременность данных: насколько значения актуальны на сегодняшнюю дату. 
+            Например: соответствует ли возраст дате рождения на сегодня, нет ли дат и годов поступления в будущем, 
+            соответствует ли статус обучения году поступления.
+
+            Верни итоговую оценку от 0 до 1 и комментария свои. Больше ничего не возвращай в ответ. 
+        """ + str(data_edtech)
+
+        return prompt_message
+
+
+class QualityOrchestrator:
+    """ Оркестратор оценки качества данных по всем пяти параметрам из README за один проход по данным. 
+        Каждый батч читается и сериализуется один раз и передается всем шагам; шаги обработки батча 
+        запускаются как граф зависимостей, независимые шаги выполняются одновременно. 
+        В режиме combined модель по каждой порции строк отвечает сразу по всем параметрам одним JSON ответом, 
+        агенты, добавленные через register_agent сверх пяти параметров, выполняются отдельными шагами
+    """
+
+    DIMENSIONS = ("accuracy", "consistency", "fulness", "timeliness", "validity")
+    ROW_SCHEMA = RowSchema({
+        'is_valid': (0, 1), 
+        'is_valid_gpt': (0, 1), 
+        'validity': ['точный', 'похож на правду', 'не похож на правду'], 
+        'is_consistent': (0, 1)
+    })
+
+    def __init__(self, client: AsyncGigaChatClient = None, data_source: DataSourceClient = None, serializer: PromptSerializer = None, 
+                 chunker: DatasetChunker = None, state: IncrementalState = None, combined: bool = True, index: ConsistencyIndex = None, 
+                 partitioned: PartitionedExecutor = None, checkpoints: CheckpointStore = None, output: PartialOutputWriter = None): 
+        self.client = client or AsyncGigaChatClient()
+        self.data_source = data_source or DataSourceClient()
+        self.serializer = serializer or PromptSerializer()
+        self.chunker = chunker or DatasetChunker(serializer=self.serializer)
+        self.state = state
+        self.combined = combined
+        # Индекс межстрочной согласованности строится один раз и общий с агентом согласованности
+        self.index = index
+        # Пул процессов для локальных этапов: проверки правил и признаки индекса всех агентов выполняются по шардам
+        self.partitioned = partitioned
+        # Контрольные точки порций строк общие для всех агентов, результаты батчей пишутся частями в output
+        self.checkpoints = checkpoints
+        self.output = output
+        # Дата запуска общая для общего промпта и всех агентов
+        self.run_date = checkpoints.run_date if checkpoints is not None else pd.Timestamp.now().strftime('%Y-%m-%d')
+        self.aggregator = ChunkResultAggregator()
+        self.requester = RowVerdictRequester(client=self.client, serializer=self.serializer)
+
+        shared = {
+            "chunker": self.chunker, 
+            "client": self.client, 
+            "state": state, 
+            "data_source": self.data_source, 
+            "serializer": self.serializer, 
+            "checkpoints": checkpoints
+        }
+        self.agents = {}
+        self.register_agent("accuracy", PrecisionAiAgent(**shared, partitioned=partitioned))
+        self.register_agent("consistency", ConsistencyAiAgent(**shared, index=index, partitioned=partitioned))
+        self.register_agent("fulness", FulnessAiAgent(**shared))
+        self.register_agent("timeliness", TimelinessAiAgent(**shared))
+        self.register_agent("validity", ValidityAiAgent(**shared, partitioned=partitioned))
+
+    def register_agent(self, dimension: str, agent): 
+        """ Добавляем агента по параметру качества: у агента должны быть STATE_KEY и process_batch, 
+            дата запуска агента приводится к дате оркестратора
+        """
+        agent.run_date = self.run_date
+        self.agents[dimension] = agent
+
+    def separate_dimensions(self) -> list: 
+        """ Параметры, которые оцениваются отдельными агентами, а не общим промптом """
+        if not self.combined:
+            return list(self.agents)
+        return [dimension for dimension in self.agents if dimension not in self.DIMENSIONS]
+
+    async def run_steps(self, steps: dict) -> dict: 
+        """ Выполняем граф шагов {имя: (зависимости, функция)}: шаг ждет результаты своих зависимостей, 
+            независимые шаги выполняются одновременно
+        """
+        tasks = {}
+
+        async def run_step(name: str):
+            dependencies, step = steps[name]
+            results = {dependency: await tasks[dependency] for dependency in dependencies}
+            return await step(results)
+
+        for name in steps:
+            tasks[name] = asyncio.ensure_future(run_step(name))
+
+        # При сбое шага дожидаемся остальных, чтобы их готовые порции успели попасть в контрольные точки
+        results = await asyncio.gather(*tasks.values(), return_exceptions=True)
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+        return dict(zip(tasks, results))
+
+    def combined_prompt(self, data_edtech: str) -> str: 
+        """ Промпт, в котором модель оценивает порцию строк сразу по всем параметрам качества """
+
+        prompt_message = """
+            На вход ты получаешь датасет о студентах в формате: """ + self.serializer.describe() + """.
+            Сегодняшняя дата: """ + self.run_date + """.
+
+            Для каждой строки определи: 
+            - is_valid - 1, если значения не отклоняются от среднего без учета выбросов больше норм data_error_standart, иначе 0
+            - is_valid_gpt - вердикт о корректности строки: 0 - не похоже на правду, 0.25 - похоже на правду на 25%, 0.5 - верно наполовину, 1 - абсолютная правда
+            - validity - одно из значений: точный, похож на правду, не похож на правду
+            - is_consistent - 1, если значения полей не противоречат друг другу и другим строкам, иначе 0
+
+            Для всей порции поставь оценки от 0 до 1: 
+            - accuracy - точность, отклонение данных от ожидаемых или реальных показателей
+            - fulness - полнота, достаточно ли атрибутов для анализа факторов успеха в обучении
+            - timeliness - своевременность, актуальны ли значения на сегодняшнюю дату
+            - validity - достоверность, (кол-во правдивых значений + точных)/(кол-во всех значений)
+
+            Верни только JSON объект вида {"rows": [{"student_id": ..., "is_valid": ..., "is_valid_gpt": ..., "validity": ..., "is_consistent": ...}], 
+            "scores": {"accuracy": ..., "fulness": ..., "timeliness": ..., "validity": ...}}, больше ничего не возвращай.
+        """ + str(data_edtech) + "data_error_standart = " + str(self.agents["accuracy"].data_error_standart)
+
+        return prompt_message
+
+    @TELEMETRY.trace("chunk")
+    @CheckpointStore.checkpointed(stage="combined", prompts=("combined_prompt",))
+    async def process_combined_chunk(self, chunk: pd.DataFrame) -> dict: 
+        """ Оцениваем порцию строк по всем параметрам одним запросом """
+
+        contents = []
+        rows = await self.requester.request(chunk, self.combined_prompt, self.ROW_SCHEMA, contents=contents)
+
+        # Оценки порции берем из первого ответа: повторные запросы содержат только часть строк
+        combined_result = self.aggregator.parse_json_object(contents[0]) if contents else {}
+        scores = combined_result.get("scores") if isinstance(combined_result.get("scores"), dict) else {}
+
+        return {
+            "rows": rows, 
+            "scores": {dimension: self.aggregator.parse_score(str(scores.get(dimension, ''))) for dimension in self.DIMENSIONS}
+        }
+
+    @TELEMETRY.trace("batch", agent="combined")
+    async def process_combined_batch(self, dataset: pd.DataFrame, screenings: dict) -> pd.DataFrame: 
+        """ Оцениваем батч по всем параметрам: строки, решенные правилами точности и достоверности и индексом согласованности, 
+            в общий промпт отправляются только если по другому правилу решения нет. 
+            Полнота и своевременность оцениваются по всем строкам: решенные правилами строки отправляются отдельными порциями, 
+            их вердикты правил ответами модели не заменяются
+        """
+
+        # Признаки аномалий передаются модели колонкой anomalies и входят в отпечаток строки
+        features = screenings["consistency"]
+        if features is not None:
+            dataset_features = dataset.assign(anomalies=features['anomalies'].to_numpy())
+            index_verdict = features['index_verdict'].to_numpy()
+        else:
+            dataset_features = dataset
+            index_verdict = np.full(len(dataset), np.nan)
+
+        changes, changed, scored_data = QualityAgent.select_changed(self.state, "combined", dataset_features)
+
+        accuracy_verdict = screenings["accuracy"]["rule_verdict"].to_numpy()[changed]
+        validity_verdict = screenings["validity"]["rule_verdict"].to_numpy()[changed]
+        index_verdict = index_verdict[changed]
+        # Решенные правилами строки не смешиваем в порциях с остальными: оценка порции по точности и достоверности 
+        # достается только строкам без решения правил. Без этих строк полнота и своевременность по таблице 
+        # считались бы только по подозрительным строкам
+        ambiguous = np.isnan(accuracy_verdict) | np.isnan(validity_verdict) | np.isnan(index_verdict)
+        chunks = self.chunker.split(scored_data[ambiguous]) + self.chunker.split(scored_data[~ambiguous])
+
+        chunk_results = await asyncio.gather(*[self.process_combined_chunk(chunk=chunk) for chunk in chunks])
+        chunk_scores = {dimension: [result["scores"][dimension] for result in chunk_results] for dimension in self.DIMENSIONS}
+
+        columns = self.ROW_SCHEMA.columns
+        combined_data = self.aggregator.join_verdicts(scored_data, [result["rows"] for result in chunk_results], self.ROW_SCHEMA)
+        # Правила решают только is_valid, is_valid_gpt - вердикт модели
+        combined_data = self.aggregator.apply_rule_verdicts(combined_data, accuracy_verdict, {'is_valid': 1}, {'is_valid': 0})
+        combined_data = self.aggregator.apply_rule_verdicts(
+            combined_data, screenings["accuracy"]["deviation_verdict"].to_numpy()[changed], {'is_valid': 1}, {'is_valid': 0}
+        )
+        combined_data = self.aggregator.apply_rule_verdicts(combined_data, validity_verdict, {'validity': 'точный'}, {'validity': 'не похож на правду'})
+        # Проверки правил достоверности входят в проверки точности, поэтому нарушения берем из них
+        combined_data['rule_violations'] = screenings["accuracy"]["rule_violations"].to_numpy()[changed]
+        # Жесткие нарушения индекса делают строку несогласованной независимо от ответа модели
+        combined_data = self.aggregator.apply_rule_verdicts(combined_data, index_verdict, {'is_consistent': 1}, {'is_consistent': 0})
+        if features is not None:
+            combined_data['rule_violations'] = combined_data['rule_violations'] + features['index_violations'].to_numpy()[changed]
+
+        # Строка могла попасть в порцию из-за другого параметра: решение правил по ней оценкой порции не заменяем
+        accuracy_scores = self.aggregator.chunk_row_scores(scored_data, chunks, chunk_scores["accuracy"])
+        combined_data['accuracy_score'] = np.where(np.isnan(accuracy_verdict), accuracy_scores, accuracy_verdict)
+        combined_data['consistency_score'] = combined_data['is_consistent'].to_numpy()
+        combined_data['fulness_score'] = self.aggregator.chunk_row_scores(scored_data, chunks, chunk_scores["fulness"])
+        combined_data['timeliness_score'] = self.aggregator.chunk_row_scores(scored_data, chunks, chunk_scores["timeliness"])
+        validity_scores = self.aggregator.chunk_row_scores(scored_data, chunks, chunk_scores["validity"])
+        combined_data['validity_score'] = np.where(np.isnan(validity_verdict), validity_scores, validity_verdict)
+
+        score_columns = [f"{dimension}_score" for dimension in self.DIMENSIONS]
+        # Общая оценка строки - среднее по тем параметрам, по которым она оценена
+        combined_data['row_score'] = combined_data[score_columns].mean(axis=1, skipna=True).to_numpy()
+
+        if self.state is not None:
+            verdicts = self.state.update("combined", changes, combined_data, columns + ['rule_violations'] + score_columns)
+            combined_data = pd.concat([dataset.reset_index(drop=True), verdicts], axis=1)
+
+        return combined_data
+
+    async def screen(self, dataset: pd.DataFrame) -> dict: 
+        """ Проверки правил точности и достоверности и признаки индекса согласованности для общего промпта, 
+            если задан пул процессов - все этапы за один проход по шардам батча
+        """
+        stages = {
+            "accuracy": self.agents["accuracy"].screen_stage(dataset), 
+            "validity": self.agents["validity"].screen_stage(dataset)
+        }
+        if self.index is not None:
+            stages["consistency"] = self.agents["consistency"].features_stage()
+
+        if self.partitioned is None:
+            screenings = {dimension: function(dataset, **params) for dimension, (function, params) in stages.items()}
+        else:
+            # Этапы называем по STATE_KEY агентов, чтобы пул не перезапускался при смене режима
+            names = {dimension: self.agents[dimension].STATE_KEY for dimension in stages}
+            results = await self.partitioned.arun(dataset, {names[dimension]: stage for dimension, stage in stages.items()})
+            screenings = {dimension: results[name] for dimension, name in names.items()}
+
+        screenings.setdefault("consistency", None)
+        return screenings
+
+    @TELEMETRY.trace("batch", agent="orchestrator")
+    async def process_batch(self, dataset: pd.DataFrame) -> dict: 
+        """ Оцениваем один батч: строим граф шагов и выполняем его """
+        steps = {}
+
+        for dimension in self.separate_dimensions():
+            agent = self.agents[dimension]
+            steps[dimension] = ([], lambda results, agent=agent: agent.process_batch(dataset))
+
+        if self.combined:
+            async def screen(results):
+                return await self.screen(dataset)
+
+            async def combined(results):
+                return await self.process_combined_batch(dataset, results["screen"])
+
+            steps["screen"] = ([], screen)
+            steps["combined"] = (["screen"], combined)
+
+        return await self.run_steps(steps)
+
+    async def aiter_batch_results(self): 
+        """ Читаем датасет один раз и отдаем результаты по каждому батчу """
+        state_keys = ["combined"] if self.combined else []
+        state_keys += [self.agents[dimension].STATE_KEY for dimension in self.separate_dimensions()]
+
+        if self.state is not None:
+            for state_key in state_keys:
+                self.state.start_run(state_key)
+        if self.output is not None:
+            self.output.start()
+
+        for batch_number, batch in enumerate(self.data_source.iter_batches()):
+            batch_result = await self.process_batch(batch)
+            if self.output is not None:
+                self.write_batch_result(batch_number, batch, batch_result)
+            yield batch_result
+
+        if self.state is not None:
+            for state_key in state_keys:
+                self.state.finish_run(state_key)
+        if self.output is not None:
+            self.output.finish()
+
+    def write_batch_result(self, batch_number: int, dataset: pd.DataFrame, batch_result: dict): 
+        """ Пишем результаты батча по шагам """
+        for name, result in batch_result.items():
+            if name != "screen":
+                self.output.write(name, batch_number, self.aggregator.batch_rows(dataset, result))
+
+    async def arun(self) -> dict: 
+        """ Оцениваем качество данных по всем параметрам и считаем общую оценку P """
+        score_sums = {dimension: 0.0 for dimension in self.agents}
+        score_counts = {dimension: 0 for dimension in self.agents}
+
+        # Результаты батчей в памяти не храним: копим суммы и число оценок, строки пишутся частями в output
+        async for batch_result in self.aiter_batch_results():
+            for dimension in self.agents:
+                if dimension in batch_result:
+                    row_scores = self.aggregator.batch_row_scores(batch_result[dimension])
+                elif "combined" in batch_result:
+                    row_scores = batch_result["combined"][f"{dimension}_score"].to_numpy(dtype=float)
+                else:
+                    continue
+                score_sums[dimension] += float(np.nansum(row_scores))
+                score_counts[dimension] += int(np.count_nonzero(~np.isnan(row_scores)))
+
+        scores = {}
+        for dimension in self.agents:
+            if self.state is not None and dimension in self.separate_dimensions():
+                scores[dimension] = self.state.dataset_score(self.agents[dimension].STATE_KEY)
+            elif self.state is not None:
+                scores[dimension] = self.state.dataset_score("combined", field=f"{dimension}_score")
+            else:
+                scores[dimension] = score_sums[dimension] / score_counts[dimension] if score_counts[dimension] else None
+
+        # Общая оценка качества данных P - среднее оценок по параметрам, как в README
+        known_scores = [score for score in scores.values() if score is not None]
+
+        return {
+            "scores": scores, 
+            "overall_score": float(np.mean(known_scores)) if known_scores else None
+        }
+
+    def run(self) -> dict: 
+        """ Синхронный запуск оценки качества по всем параметрам """
+        return asyncio.run(self.arun())
+
+
+class SampledQualityEstimator:
+    """ Оценка качества больших таблиц по стратифицированной выборке. 
+        Строки делятся на страты (по умолчанию faculty, enrollment_status, admission_year), 
+        выборка распределяется по стратам пропорционально их размеру и оценивается существующими агентами. 
+        Выборка растет, пока доверительный интервал каждой оценки не станет уже заданной точности, 
+        поэтому число запросов к модели зависит от требуемой точности, а не от размера таблицы
+    """
+
+    STRATA = ("faculty", "enrollment_status", "admission_year")
+
+    def __init__(self, data_source: DataSourceClient = None, agents: dict = None, client: AsyncGigaChatClient = None, 
+                 strata: tuple = STRATA, precision: float = 0.05, confidence: float = 0.95, initial_sample: int = 200, 
+                 max_sample: int = 5000, growth: float = 2.0, seed: int = 0): 
+        self.data_source = data_source or DataSourceClient()
+        self.client = client or AsyncGigaChatClient()
+        # Агенты без инкрементального состояния: выборка оценивается целиком, а не по изменениям
+        self.agents = agents or {
+            "accuracy": PrecisionAiAgent(client=self.client), 
+            "validity": ValidityAiAgent(client=self.client), 
+            "fulness": FulnessAiAgent(client=self.client)
+        }
+        self.strata = list(strata)
+        # Допустимая полуширина доверительного интервала
+        self.precision = precision
+        self.z = statistics.NormalDist().inv_cdf((1 + confidence) / 2)
+        self.confidence = confidence
+        self.initial_sample = initial_sample
+        self.max_sample = max_sample
+        self.growth = growth
+        self.seed = seed
+        self.aggregator = ChunkResultAggregator()
+        # Номер объединенной страты для каждой исходной, заполняется при подсчете страт
+        self.merged_strata = None
+
+    def stratum_ids(self, dataset_edtech: pd.DataFrame) -> np.ndarray: 
+        """ Номер страты строки - хэш значений полей стратификации """
+        columns = [column for column in self.strata if column in dataset_edtech.columns]
+        if not columns:
+            return np.zeros(len(dataset_edtech), dtype=np.uint64)
+        return pd.util.hash_pandas_object(dataset_edtech[columns], index=False).to_numpy()
+
+    def priorities(self, dataset_edtech: pd.DataFrame) -> np.ndarray: 
+        """ Случайный, но воспроизводимый приоритет строки: выборка - строки с наименьшим приоритетом в страте, 
+            поэтому меньшая выборка всегда входит в большую и уже оцененные строки не оцениваются заново
+        """
+        key = dataset_edtech[['student_id']] if 'student_id' in dataset_edtech.columns else dataset_edtech
+        hashes = pd.util.hash_pandas_object(key, index=False, hash_key=f"{self.seed:016d}"[-16:]).to_numpy()
+        return hashes / float(2 ** 64)
+
+    def count_strata(self) -> pd.Series: 
+        """ Первый проход по данным: размеры страт, мелкие страты объединяются """
+        counts = pd.Series(dtype=np.int64)
+        for batch in self.data_source.iter_batches():
+            counts = counts.add(pd.Series(self.stratum_ids(batch)).value_counts(), fill_value=0)
+        self.merged_strata = self.merge_strata(counts)
+        return counts.groupby(self.merged_strata).sum().astype(np.int64)
+
+    def merge_strata(self, population: pd.Series) -> pd.Series: 
+        """ Страты, на которые при начальной выборке приходится меньше 2 строк, объединяются в одну: 
+            иначе выборка разошлась бы по мелким стратам, а дисперсию в них все равно не оценить. 
+            Возвращает номер объединенной страты для каждой исходной
+        """
+        sample_size = min(self.initial_sample, self.max_sample)
+        small = sample_size * population / population.sum() < 2
+        merged = pd.Series(population.index, index=population.index)
+        if small.sum() > 1:
+            merged[small] = population.index[small].min()
+        return merged
+
+    def allocate(self, sample_size: int, population: pd.Series) -> pd.Series: 
+        """ Пропорциональное размещение выборки по стратам методом наибольших остатков: 
+            сумма по стратам равна размеру выборки и не превышает размер страты
+        """
+        sample_size = min(sample_size, int(population.sum()))
+        exact = sample_size * population / population.sum()
+        allocation = np.floor(exact)
+        remainder = int(sample_size - allocation.sum())
+        allocation[(exact - allocation).sort_values(ascending=False, kind='stable').index[:remainder]] += 1
+        return np.minimum(allocation, population).astype(np.int64)
+
+    def draw_candidates(self, population: pd.Series) -> pd.DataFrame: 
+        """ Второй проход по данным: в каждой страте оставляем строки с наименьшим приоритетом 
+            в количестве, достаточном для максимальной выборки
+        """
+        # С запасом на округление: меньшая выборка может получить в страте на строку больше
+        limits = np.minimum(np.ceil(min(self.max_sample, population.sum()) * population / population.sum()), population)
+        candidates = None
+
+        for batch in self.data_source.iter_batches():
+            batch = batch.assign(_stratum=self.merged_strata.reindex(self.stratum_ids(batch)).to_numpy(), _priority=self.priorities(batch))
+            candidates = batch if candidates is None else pd.concat([candidates, batch], ignore_index=True)
+            candidates = candidates.sort_values('_priority', kind='stable')
+            candidates = candidates[candidates.groupby('_stratum').cumcount().to_numpy() < candidates['_stratum'].map(limits).to_numpy()]
+
+        candidates = candidates.reset_index(drop=True)
+        candidates['_rank'] = candidates.groupby('_stratum').cumcount()
+        return candidates
+
+    def estimate(self, stratum: np.ndarray, row_scores: np.ndarray, population: pd.Series, clusters: np.ndarray = None) -> dict: 
+        """ Стратифицированная оценка среднего с доверительным интервалом: 
+            среднее = sum(W_h * mean_h), дисперсия = sum(W_h^2 * (1 - n_h/N_h) * s_h^2 / n_h), W_h = N_h / N. 
+            Страты без оцененных строк не учитываются, веса остальных нормируются. 
+            Если оценка выставлена порции строк целиком (clusters - номер порции строки), 
+            строки порции не независимы и дисперсия считается по порциям
+        """
+        scored = pd.DataFrame({'stratum': stratum, 'score': row_scores, 
+                               'cluster': -1 if clusters is None else clusters}).dropna()
+        if scored.empty:
+            return {"estimate": None, "ci_low": None, "ci_high": None, "margin": None, "sample_size": 0}
+
+        groups = scored.groupby('stratum')['score'].agg(['mean', 'var', 'count'])
+        sizes = population.reindex(groups.index).astype(float)
+        weights = sizes / sizes.sum()
+        estimate = float((weights * groups['mean']).sum())
+
+        if (scored['cluster'] < 0).all():
+            # В страте из одной строки дисперсию не оценить, берем общую дисперсию выборки
+            groups['var'] = groups['var'].fillna(scored['score'].var(ddof=1) if len(scored) > 1 else 0.25)
+            variance = float((weights ** 2 * (1 - groups['count'] / sizes) * groups['var'] / groups['count']).sum())
+        else:
+            variance = self.cluster_variance(scored, estimate, weights / groups['count'])
+        margin = float(self.z * np.sqrt(max(variance, 0.0)))
+
+        return {
+            "estimate": estimate, 
+            "ci_low": max(0.0, estimate - margin), 
+            "ci_high": min(1.0, estimate + margin), 
+            "margin": margin, 
+            "sample_size": int(groups['count'].sum())
+        }
+
+    def cluster_variance(self, scored: pd.DataFrame, estimate: float, row_weights: pd.Series) -> float: 
+        """ Дисперсия оценки по порциям: вклад строки w_i * (y_i - среднее) суммируется по порции, 
+            дисперсия = m / (m - 1) * sum(Z_c^2) по m порциям. Строка без порции считается отдельной порцией, 
+            по одной порции дисперсию не оценить, берем наибольшую возможную для оценок от 0 до 1
+        """
+        contributions = scored['stratum'].map(row_weights) * (scored['score'] - estimate)
+        # Строки без номера порции получают собственные номера, не пересекающиеся с номерами порций
+        clusters = scored['cluster'].where(scored['cluster'] >= 0, -1 - np.arange(len(scored)))
+        totals = contributions.groupby(clusters.to_numpy()).sum()
+        if len(totals) < 2:
+            return 0.25
+        return float(len(totals) / (len(totals) - 1) * ((totals - totals.mean()) ** 2).sum())
+
+    async def score_rows(self, rows: pd.DataFrame) -> dict: 
+        """ Оцениваем новые строки выборки всеми агентами одновременно: построчные оценки и номера порций """
+        dataset_edtech = rows.drop(columns=['_stratum', '_priority', '_rank']).reset_index(drop=True)
+        results = await asyncio.gather(*[agent.process_batch(dataset_edtech) for agent in self.agents.values()])
+        return {
+            dimension: (self.aggregator.batch_row_scores(result), self.aggregator.batch_row_chunks(result)) 
+            for dimension, result in zip(self.agents, results)
+        }
+
+    async def arun(self) -> dict: 
+        """ Наращиваем выборку, пока все оценки не достигнут заданной точности или выборка не упрется в max_sample """
+        population = self.count_strata()
+        candidates = self.draw_candidates(population)
+        row_scores = {dimension: np.full(len(candidates), np.nan) for dimension in self.agents}
+        # Номер порции, в которой строка получила оценку, сквозной по всем шагам; -1 - оценка построчная
+        row_clusters = {dimension: np.full(len(candidates), -1, dtype=np.int64) for dimension in self.agents}
+        scored = np.zeros(len(candidates), dtype=bool)
+
+        sample_size = min(self.initial_sample, self.max_sample)
+        while True:
+            allocation = self.allocate(sample_size, population)
+            in_sample = candidates['_rank'].to_numpy() < candidates['_stratum'].map(allocation).to_numpy()
+            new_rows = in_sample & ~scored
+
+            if new_rows.any():
+                new_scores = await self.score_rows(candidates[new_rows])
+                for dimension, (scores, chunks) in new_scores.items():
+                    row_scores[dimension][new_rows] = scores
+                    if chunks is not None:
+                        offset = row_clusters[dimension].max() + 1
+                        row_clusters[dimension][new_rows] = np.where(chunks >= 0, chunks + offset, -1)
+                scored |= new_rows
+
+            stratum = candidates['_stratum'].to_numpy()
+            scores = {
+                dimension: self.estimate(stratum[in_sample], values[in_sample], population, row_clusters[dimension][in_sample]) 
+                for dimension, values in row_scores.items()
+            }
+
+            converged = all(score["margin"] is not None and score["margin"] <= self.precision for score in scores.values())
+            if converged or sample_size >= self.max_sample or in_sample.all():
+                break
+            sample_size = min(int(np.ceil(sample_size * self.growth)), self.max_sample)
+
+        return {
+            "scores": scores, 
+            "converged": converged, 
+            "confidence": self.confidence, 
+            "sample_size": int(in_sample.sum()), 
+            "population": int(population.sum()), 
+            "strata": int(len(population))
+        }
+
+    def run(self) -> dict: 
+        """ Синхронный запуск оценки по выборке """
+        return asyncio.run(self.arun())
+
 
 if __name__ == '__main__': 
+
+    parser = argparse.ArgumentParser(description="Оценка качества данных агентами GigaChat")
+    parser.add_argument("--resume", action="store_true", help="продолжить прерванный запуск: готовые порции строк берутся из контрольных точек")
+    parser.add_argument("--output", default="quality_output", help="каталог частичных результатов по батчам")
+    parser.add_argument("--processes", type=int, default=1, help="число процессов для проверок правил и признаков индекса, нужен pyarrow")
+    args = parser.parse_args()
         
-    # читаем данные 
-    ds = DataSourceClient()
-    data_edtech = ds.create_dataset()
-    data_edtech_json = ds.dataset_from_dataframe_to_json(dataset_edtech=data_edtech)
+    # читаем данные батчами, не загружая файл в память целиком
+    ds = DataSourceClient(reader=CsvChunkReader("data_edtech.csv", batch_size=50000))
+
+    # токен доступа к API GigaChat кэшируется и обновляется до истечения срока действия
+    token_provider = TokenProvider(model_client=AiModelClient())
+
+    # общий клиент GigaChat для всех агентов: пул соединений, лимиты запросов и кэш ответов на диске
+    cache = ResponseCache()
+    client = AsyncGigaChatClient(token_provider=token_provider, cache=cache, deterministic=True)
+
+    # построчное состояние прошлых запусков: повторно оцениваются только новые и измененные строки
+    state = IncrementalState()
+
+    # проверки правил и признаки индекса выполняются по шардам батча в нескольких процессах, если это запрошено
+    partitioned = PartitionedExecutor(processes=args.processes) if args.processes > 1 else None
+
+    # результат каждой порции строк сохраняется сразу, после сбоя запуск продолжается с --resume
+    checkpoints = CheckpointStore(resume=args.resume)
+    output = PartialOutputWriter(directory=args.output, resume=args.resume)
 
-    # получаем токен доступа к API GigaChat 
-    ai_model = AiModelClient()
-    token = ai_model.get_token_auth()
+    # оцениваем все пять параметров качества за один проход по данным
+    orchestrator = QualityOrchestrator(client=client, data_source=ds, state=state, index=ConsistencyIndex(), partitioned=partitioned, 
+                                       checkpoints=checkpoints, output=output)
+    quality_result = orchestrator.run()
+    client.close()
+    if partitioned is not None:
+        partitioned.close()
 
-    # определяем точность данных 
-    # precision_agent = PrecisionAiAgent()
-    # data_result_accuracy = precision_agent.create_agent_chain(token=token)
+    print(checkpoints.stats())
+    checkpoints.close()
 
-    # определяем полноты данных 
-    # fulness_agent = FulnessAiAgent()
-    # data_result_fulness = fulness_agent.create_agent_chain(token=token)
+    print(cache.stats())
+    cache.close()
+    state.close()
 
-    # определяем достоверность данных
-    validity_agent = ValidityAiAgent()
-    validity_agent_result = validity_agent.create_agent_chain(token=token)
+    print(quality_result['scores'])
+    print(quality_result['overall_score'])
 
-    print(validity_agent_result['validity_score'])
+    # время и токены по агентам и этапам, выгрузка спанов и метрик
+    print(TELEMETRY.summary().to_string(index=False))
+    TELEMETRY.export_json("telemetry.jsonl")
+    TELEMETRY.export_prometheus("telemetry.prom")
@@ -0,0 +1,197 @@
+"""
+Бенчмарк конвейера агентов на локальном тестовом сервере GigaChat (mock_gigachat.py).
+Агенты прогоняются на синтетических таблицах, размноженных из data_edtech.csv, и для каждого прогона
+считаются строки в секунду, задержка вызова API (p50/p99), отправленные токены и пиковая память процесса.
+
+Запуск: python benchmark.py --sizes 1000,100000,1000000 --agents precision,fulness,validity --latency 0.05
+Каждый прогон выполняется в отдельном процессе, чтобы пиковая память не накапливалась между прогонами.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+import ai_etl
+from mock_gigachat import MockGigaChatServer
+
+
+class SyntheticDataset:
+    """ Синтетическая таблица нужного размера из строк data_edtech.csv:
+        student_id и email делаются уникальными, числовые поля немного зашумляются
+    """
+
+    NOISY_COLUMNS = ("scholarship_amount", "average_study_hours", "library_visits_per_month")
+
+    def __init__(self, source: str = "data_edtech.csv", data_dir: str = "bench_data", block_rows: int = 100000, seed: int = 0):
+        self.source = pd.read_csv(source)
+        self.data_dir = data_dir
+        self.block_rows = block_rows
+        self.seed = seed
+
+    def path(self, rows: int) -> str:
+        return os.path.join(self.data_dir, f"data_edtech_{rows}.csv")
+
+    def make(self, rows: int) -> str:
+        """ Пишем таблицу блоками, чтобы не держать миллион строк в памяти, повторно не генерируем """
+        path = self.path(rows)
+        if os.path.exists(path):
+            return path
+
+        os.makedirs(self.data_dir, exist_ok=True)
+        rng = np.random.default_rng(self.seed)
+        temp_path = path + ".tmp"
+
+        for offset in range(0, rows, self.block_rows):
+            size = min(self.block_rows, rows - offset)
+            block = self.source.iloc[np.arange(offset, offset + size) % len(self.source)].reset_index(drop=True)
+
+            student_id = np.arange(offset + 1, offset + size + 1)
+            block["student_id"] = student_id
+            block["email"] = [email.replace("@", f".{number}@") for email, number in zip(block["email"].fillna("").astype(str), student_id)]
+            for column in self.NOISY_COLUMNS:
+                noise = rng.uniform(0.9, 1.1, size)
+                block[column] = (pd.to_numeric(block[column], errors="coerce") * noise).round().astype("Int64")
+
+            block.to_csv(temp_path, mode="w" if offset == 0 else "a", header=offset == 0, index=False)
+
+        os.replace(temp_path, path)
+        return path
+
+
+class PipelineBenchmark:
+    """ Прогон одного агента по одной таблице с замером пропускной способности, задержек, токенов и памяти """
+
+    AGENTS = {
+        "precision": ai_etl.PrecisionAiAgent,
+        "fulness": ai_etl.FulnessAiAgent,
+        "validity": ai_etl.ValidityAiAgent,
+        "orchestrator": ai_etl.QualityOrchestrator
+    }
+
+    def __init__(self, auth_url: str, api_url: str, batch_size: int = 50000, max_concurrency: int = 8,
+                 requests_per_second: float = 1000.0, stream: bool = False):
+        self.auth_url = auth_url
+        self.api_url = api_url
+        self.batch_size = batch_size
+        self.max_concurrency = max_concurrency
+        self.requests_per_second = requests_per_second
+        self.stream = stream
+
+    def make_client(self, latencies: list) -> ai_etl.AsyncGigaChatClient:
+        """ Клиент без кэша, каждый вызов API замеряется """
+        client = ai_etl.AsyncGigaChatClient(
+            token_provider=ai_etl.TokenProvider(model_client=ai_etl.AiModelClient(base_url=self.auth_url)),
+            max_concurrency=self.max_concurrency, requests_per_second=self.requests_per_second,
+            backoff=0.05, api_url=self.api_url, stream=self.stream
+        )
+        post_chat = client.post_chat
+
+        def timed_post_chat(messages: list) -> tuple:
+            started = time.perf_counter()
+            result = post_chat(messages)
+            latencies.append(time.perf_counter() - started)
+            return result
+
+        client.post_chat = timed_post_chat
+        return client
+
+    async def run_agent(self, agent):
+        if isinstance(agent, ai_etl.QualityOrchestrator):
+            return await agent.arun()
+        return await agent.acreate_agent_chain()
+
+    def run(self, agent_name: str, path: str) -> dict:
+        """ Прогоняем агента по таблице и собираем метрики """
+        latencies = []
+        client = self.make_client(latencies)
+        data_source = ai_etl.DataSourceClient(reader=ai_etl.CsvChunkReader(path, batch_size=self.batch_size))
+        agent = self.AGENTS[agent_name](client=client, data_source=data_source)
+
+        rows = sum(1 for _ in open(path, encoding="utf-8")) - 1
+        started = time.perf_counter()
+        asyncio.run(self.run_agent(agent))
+        elapsed = time.perf_counter() - started
+        client.close()
+
+        latencies = np.array(latencies) * 1000
+        return {
+            "agent": agent_name,
+            "rows": rows,
+            "seconds": round(elapsed, 3),
+            "rows_per_sec": round(rows / elapsed, 1) if elapsed else None,
+            "api_calls": client.usage["calls"],
+            "latency_p50_ms": round(float(np.percentile(latencies, 50)), 2) if len(latencies) else None,
+            "latency_p99_ms": round(float(np.percentile(latencies, 99)), 2) if len(latencies) else None,
+            "prompt_tokens": client.usage["prompt_tokens"],
+            "completion_tokens": client.usage["completion_tokens"],
+            # На Linux ru_maxrss в килобайтах
+            "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+        }
+
+
+def print_report(results: list):
+    columns = ["agent", "rows", "seconds", "rows_per_sec", "api_calls", "latency_p50_ms", "latency_p99_ms", "prompt_tokens", "peak_rss_mb"]
+    print(pd.DataFrame(results, columns=columns).to_string(index=False))
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description="Бенчмарк агентов качества данных на тестовом сервере GigaChat")
+    parser.add_argument("--sizes", default="1000,100000,1000000", help="размеры таблиц через запятую")
+    parser.add_argument("--agents", default="precision,fulness,validity", help="агенты через запятую: " + ",".join(PipelineBenchmark.AGENTS))
+    parser.add_argument("--source", default="data_edtech.csv")
+    parser.add_argument("--data-dir", default="bench_data")
+    parser.add_argument("--batch-size", type=int, default=50000)
+    parser.add_argument("--max-concurrency", type=int, default=8)
+    parser.add_argument("--requests-per-second", type=float, default=1000.0)
+    parser.add_argument("--stream", action="store_true", help="потоковый режим ответов")
+    parser.add_argument("--latency", type=float, default=0.05, help="задержка тестового сервера, секунды")
+    parser.add_argument("--jitter", type=float, default=0.01)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--response-chars", type=int, default=0)
+    parser.add_argument("--output", default=None, help="файл для результатов в JSON")
+    # Внутренний режим: один прогон в отдельном процессе
+    parser.add_argument("--case", nargs=2, metavar=("AGENT", "PATH"), help=argparse.SUPPRESS)
+    parser.add_argument("--auth-url", help=argparse.SUPPRESS)
+    parser.add_argument("--api-url", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.case:
+        benchmark = PipelineBenchmark(auth_url=args.auth_url, api_url=args.api_url, batch_size=args.batch_size,
+                                      max_concurrency=args.max_concurrency, requests_per_second=args.requests_per_second,
+                                      stream=args.stream)
+        print(json.dumps(benchmark.run(*args.case)))
+        sys.exit(0)
+
+    server = MockGigaChatServer(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                                response_chars=args.response_chars, seed=0).start()
+    dataset = SyntheticDataset(source=args.source, data_dir=args.data_dir)
+
+    results = []
+    for size in [int(size) for size in args.sizes.split(",")]:
+        path = dataset.make(size)
+        for agent_name in args.agents.split(","):
+            command = [
+                sys.executable, __file__, "--case", agent_name, path, "--auth-url", server.auth_url, "--api-url", server.api_url,
+                "--batch-size", str(args.batch_size), "--max-concurrency", str(args.max_concurrency),
+                "--requests-per-second", str(args.requests_per_second)
+            ] + (["--stream"] if args.stream else [])
+            completed = subprocess.run(command, capture_output=True, text=True, check=True)
+            results.append(json.loads(completed.stdout.strip().splitlines()[-1]))
+            print(f"{agent_name} {size}: {results[-1]['rows_per_sec']} строк/с", flush=True)
+
+    server.stop()
+
+    print()
+    print_report(results)
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
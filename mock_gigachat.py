@@ -0,0 +1,260 @@
+"""
+Локальный тестовый сервер GigaChat API: эндпоинты авторизации (/api/v2/oauth) и
+/api/v1/chat/completions с настраиваемыми задержкой, долей ошибок и размером ответа.
+Используется для прогона агентов и бенчмарков без обращения к сервисам Сбера.
+
+Запуск: python mock_gigachat.py --port 8089 --latency 0.2 --error-rate 0.05
+Клиент направляется на сервер переменными окружения:
+    GIGACHAT_AUTH_URL=http://127.0.0.1:8089/api/v2/oauth
+    GIGACHAT_API_URL=http://127.0.0.1:8089/api/v1/chat/completions
+"""
+
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+
+class MockGigaChatServer:
+    """ Тестовый сервер GigaChat API. Ответы собираются по тексту промпта:
+        на построчные промпты возвращается JSON по всем student_id из данных, на остальные - оценка и комментарий
+    """
+
+    AUTH_PATH = "/api/v2/oauth"
+    CHAT_PATH = "/api/v1/chat/completions"
+    ERROR_STATUSES = (429, 500, 503)
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.05, jitter: float = 0.0,
+                 error_rate: float = 0.0, response_chars: int = 0, token_ttl: float = 1800.0, chars_per_token: float = 3.0,
+                 seed: int = None):
+        self.latency = latency
+        self.jitter = jitter
+        # Доля запросов, на которые сервер отвечает 429/500/503
+        self.error_rate = error_rate
+        # Дополнительный текст в каждом ответе, чтобы проверить работу с большими ответами
+        self.response_chars = response_chars
+        self.token_ttl = token_ttl
+        self.chars_per_token = chars_per_token
+        self.random = random.Random(seed)
+        self.tokens = set()
+        self.lock = threading.Lock()
+        self.stats = {"auth": 0, "chat": 0, "errors": 0, "unauthorized": 0}
+
+        self.httpd = ThreadingHTTPServer((host, port), self.make_handler())
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def auth_url(self) -> str:
+        return self.base_url + self.AUTH_PATH
+
+    @property
+    def api_url(self) -> str:
+        return self.base_url + self.CHAT_PATH
+
+    def start(self) -> "MockGigaChatServer":
+        """ Запускаем сервер в фоновом потоке """
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """ Останавливаем сервер """
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def count(self, name: str):
+        with self.lock:
+            self.stats[name] += 1
+
+    def issue_token(self) -> dict:
+        """ Выдаем токен доступа, срок действия в миллисекундах, как у GigaChat """
+        token = uuid.uuid4().hex
+        with self.lock:
+            self.tokens.add(token)
+        return {"access_token": token, "expires_at": int((time.time() + self.token_ttl) * 1000)}
+
+    def is_authorized(self, header: str) -> bool:
+        token = header[len("Bearer "):] if header and header.startswith("Bearer ") else None
+        with self.lock:
+            return token in self.tokens
+
+    def extract_student_ids(self, prompt: str) -> list:
+        """ Достаем student_id из данных промпта: json, columnar, csv и tsv форматы """
+        columnar = re.search(r'"student_id"\s*:\s*\[([^\]]*)\]', prompt)
+        if columnar:
+            return [int(value) for value in re.findall(r'-?\d+', columnar.group(1))]
+
+        ids = re.findall(r'"student_id"\s*:\s*(-?\d+)', prompt)
+        if ids:
+            return [int(value) for value in ids]
+
+        lines = prompt.splitlines()
+        for number, line in enumerate(lines):
+            line = line.strip()
+            if not line.startswith('student_id'):
+                continue
+            separator = '\t' if '\t' in line else ','
+            for row in lines[number + 1:]:
+                value = row.strip().split(separator)[0]
+                if not value.lstrip('-').isdigit():
+                    break
+                ids.append(int(value))
+            return ids
+
+        return []
+
+    def make_content(self, prompt: str) -> str:
+        """ Собираем ответ по типу промпта """
+        student_ids = self.extract_student_ids(prompt)
+        padding = "x" * self.response_chars
+
+        if '"scores"' in prompt:
+            rows = [
+                {"student_id": student_id, "is_valid": self.random.choice([0, 1]), "is_valid_gpt": self.random.choice([0, 0.25, 0.5, 1]),
+                 "validity": self.random.choice(["точный", "похож на правду", "не похож на правду"]), "is_consistent": self.random.choice([0, 1])}
+                for student_id in student_ids
+            ]
+            scores = {name: round(self.random.random(), 2) for name in ("accuracy", "fulness", "timeliness", "validity")}
+            return json.dumps({"rows": rows, "scores": scores, "comment": padding}, ensure_ascii=False)
+
+        # Построчные промпты просят "JSON список объектов с полями student_id и <поле>"
+        field = re.search(r'JSON список объектов с полями student_id и (\w+)', prompt)
+        if not student_ids or field is None:
+            return f"{round(self.random.random(), 2)} {padding}".strip()
+
+        field = field.group(1)
+        if field == 'is_valid' and 'точный' in prompt:
+            values = ["точный", "похож на правду", "не похож на правду"]
+        elif field == 'is_valid_gpt':
+            values = [0, 0.25, 0.5, 1]
+        else:
+            values = [0, 1]
+        rows = [{"student_id": student_id, field: self.random.choice(values)} for student_id in student_ids]
+
+        return json.dumps(rows, ensure_ascii=False) + (f"\n{padding}" if padding else "")
+
+    def make_usage(self, messages: list, content: str) -> dict:
+        """ Примерный расход токенов по длине текста """
+        prompt_tokens = int(sum(len(message.get("content", "")) for message in messages) / self.chars_per_token)
+        completion_tokens = int(len(content) / self.chars_per_token)
+        return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens}
+
+    def make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def send_json(self, status: int, payload: dict, headers: dict = None):
+                body = json.dumps(payload, ensure_ascii=False).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def send_stream(self, content: str, usage: dict):
+                """ Отдаем ответ фрагментами в формате server-sent events """
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+
+                events = [{"choices": [{"delta": {"content": content[i:i + 32]}, "index": 0}]} for i in range(0, len(content), 32)]
+                events.append({"choices": [{"delta": {"content": ""}, "index": 0, "finish_reason": "stop"}], "usage": usage})
+                for event in events:
+                    self.write_chunk(f"data: {json.dumps(event, ensure_ascii=False)}\n\n".encode())
+                self.write_chunk(b"data: [DONE]\n\n")
+                self.write_chunk(b"")
+
+            def write_chunk(self, data: bytes):
+                self.wfile.write(f"{len(data):X}\r\n".encode() + data + b"\r\n")
+
+            def read_body(self) -> bytes:
+                return self.rfile.read(int(self.headers.get("Content-Length") or 0))
+
+            def do_POST(self):
+                body = self.read_body()
+
+                if self.path == server.AUTH_PATH:
+                    server.count("auth")
+                    if "scope" not in parse_qs(body.decode()):
+                        self.send_json(400, {"message": "scope is required"})
+                        return
+                    self.send_json(200, server.issue_token())
+                    return
+
+                if self.path != server.CHAT_PATH:
+                    self.send_json(404, {"message": "not found"})
+                    return
+
+                server.count("chat")
+                if not server.is_authorized(self.headers.get("Authorization")):
+                    server.count("unauthorized")
+                    self.send_json(401, {"message": "unauthorized"})
+                    return
+
+                time.sleep(max(0.0, server.latency + server.random.uniform(-server.jitter, server.jitter)))
+
+                if server.random.random() < server.error_rate:
+                    server.count("errors")
+                    status = server.random.choice(server.ERROR_STATUSES)
+                    self.send_json(status, {"message": "mock error"}, headers={"Retry-After": "0"} if status == 429 else None)
+                    return
+
+                request = json.loads(body or b"{}")
+                messages = request.get("messages", [])
+                content = server.make_content(messages[-1]["content"] if messages else "")
+                usage = server.make_usage(messages, content)
+
+                if request.get("stream"):
+                    self.send_stream(content, usage)
+                    return
+
+                self.send_json(200, {
+                    "choices": [{"message": {"role": "assistant", "content": content}, "index": 0, "finish_reason": "stop"}],
+                    "created": int(time.time()),
+                    "model": request.get("model", "GigaChat"),
+                    "object": "chat.completion",
+                    "usage": usage
+                })
+
+        return Handler
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description="Локальный тестовый сервер GigaChat API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency", type=float, default=0.05, help="задержка ответа, секунды")
+    parser.add_argument("--jitter", type=float, default=0.0, help="разброс задержки, секунды")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="доля ответов 429/500/503")
+    parser.add_argument("--response-chars", type=int, default=0, help="дополнительный текст в каждом ответе, символы")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    server = MockGigaChatServer(host=args.host, port=args.port, latency=args.latency, jitter=args.jitter,
+                                error_rate=args.error_rate, response_chars=args.response_chars, seed=args.seed)
+    print(f"GIGACHAT_AUTH_URL={server.auth_url}")
+    print(f"GIGACHAT_API_URL={server.api_url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
@@ -0,0 +1,39 @@
+import sqlite3
+
+import pandas as pd
+
+import ai_etl
+
+
+def set_run_date(path: str, run_date: str):
+    with sqlite3.connect(path) as connection:
+        connection.execute("UPDATE run_meta SET value = ? WHERE key = 'run_date'", (run_date,))
+
+
+def test_resume_keeps_run_date_and_stage_config(tmp_path):
+    path = str(tmp_path / "checkpoints.sqlite")
+    client = ai_etl.AsyncGigaChatClient(token_provider=object())
+    prompts = ("read_dataset_edtech_data_prompt",)
+
+    store = ai_etl.CheckpointStore(path=path)
+    store.close()
+    # Прерванный запуск начался в другой день
+    set_run_date(path, "2020-01-01")
+
+    store = ai_etl.CheckpointStore(path=path, resume=True)
+    agent = ai_etl.TimelinessAiAgent(client=client, checkpoints=store)
+    resumed_config = store.stage_config(agent, prompts)
+    store.close()
+
+    assert store.run_date == "2020-01-01"
+    assert "2020-01-01" in agent.read_dataset_edtech_data_prompt("")
+
+    store = ai_etl.CheckpointStore(path=path, resume=True)
+    assert store.stage_config(ai_etl.TimelinessAiAgent(client=client, checkpoints=store), prompts) == resumed_config
+    store.close()
+
+    # Новый запуск без resume берет сегодняшнюю дату
+    store = ai_etl.CheckpointStore(path=path)
+    assert store.run_date == pd.Timestamp.now().strftime('%Y-%m-%d')
+    store.close()
+    client.close()
@@ -0,0 +1,51 @@
+import numpy as np
+import pandas as pd
+
+import ai_etl
+
+
+def make_dataset(rows: int) -> pd.DataFrame:
+    return pd.DataFrame({
+        "student_id": np.arange(1, rows + 1), 
+        "full_name": [f"Студент номер {i}" for i in range(1, rows + 1)], 
+        "gpa": np.round(np.linspace(2.0, 5.0, rows), 2)
+    })
+
+
+def test_chunks_cover_dataset_in_order():
+    dataset = make_dataset(230)
+
+    chunks = ai_etl.DatasetChunker(max_tokens=400, max_rows=50).split(dataset)
+
+    pd.testing.assert_frame_equal(pd.concat(chunks), dataset)
+
+
+def test_chunks_respect_token_and_row_budget():
+    dataset = make_dataset(230)
+    serializer = ai_etl.PromptSerializer(format="csv")
+    chunker = ai_etl.DatasetChunker(max_tokens=300, max_rows=20, serializer=serializer)
+
+    for chunk in chunker.split(dataset):
+        assert len(chunk) <= 20
+        assert len(chunk) == 1 or chunker.estimate_row_tokens(chunk).sum() <= 300
+
+
+def test_oversized_row_goes_alone():
+    dataset = make_dataset(3)
+    dataset.loc[1, "full_name"] = "x" * 5000
+
+    chunks = ai_etl.DatasetChunker(max_tokens=100, max_rows=50, stable_boundaries=False).split(dataset)
+
+    assert [len(chunk) for chunk in chunks] == [1, 1, 1]
+
+
+def test_stable_boundaries_keep_other_chunks_after_insert():
+    dataset = make_dataset(400)
+    chunker = ai_etl.DatasetChunker(max_tokens=100000, max_rows=50)
+    before = [tuple(chunk["student_id"]) for chunk in chunker.split(dataset)]
+
+    inserted = pd.concat([dataset.iloc[:200], make_dataset(1).assign(student_id=10000), dataset.iloc[200:]], ignore_index=True)
+    after = [tuple(chunk["student_id"]) for chunk in chunker.split(inserted)]
+
+    # Вставка строки меняет только порцию, в которую она попала
+    assert len(set(before) - set(after)) <= 2
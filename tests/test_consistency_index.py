@@ -0,0 +1,22 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+
+import ai_etl
+
+
+def build_index(batches: list) -> ai_etl.ConsistencyIndex:
+    source = ai_etl.DataSourceClient(reader=SimpleNamespace(iter_batches=lambda: iter(batches)))
+    return ai_etl.ConsistencyIndex().build(source)
+
+
+def test_float_student_ids_counted_with_integer_ids():
+    # Во втором батче пропущен student_id, поэтому pandas читает колонку как float64
+    batches = [pd.DataFrame({"student_id": [1, 2]}), pd.DataFrame({"student_id": [1.0, np.nan]})]
+    index = build_index(batches)
+
+    features = index.features(batches[1])
+
+    np.testing.assert_array_equal(features["dup_student_id"], [1, 0])
+    np.testing.assert_array_equal(features["index_verdict"], [ai_etl.RuleEngine.FAILED, ai_etl.RuleEngine.PASSED])
@@ -0,0 +1,84 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import ai_etl
+
+
+@pytest.fixture
+def state(tmp_path):
+    state = ai_etl.IncrementalState(path=str(tmp_path / "state.sqlite"))
+    yield state
+    state.close()
+
+
+def score_batch(state: ai_etl.IncrementalState, dataset: pd.DataFrame) -> dict:
+    changes = state.diff("precision", dataset)
+    scored = dataset[changes["changed"]].assign(is_valid=1, row_score=1.0)
+    state.update("precision", changes, scored, ["is_valid"])
+    return changes
+
+
+def test_diff_detects_inserted_and_updated_rows(state):
+    dataset = pd.DataFrame({"student_id": [1, 2, 3], "gpa": [3.1, 4.2, 2.8]})
+
+    state.start_run("precision")
+    first = score_batch(state, dataset)
+    state.finish_run("precision")
+    assert first["inserted"].all()
+
+    changed_dataset = pd.DataFrame({"student_id": [1, 2, 3, 4], "gpa": [3.1, 4.5, 2.8, 3.9]})
+    state.start_run("precision")
+    second = score_batch(state, changed_dataset)
+    state.finish_run("precision")
+
+    np.testing.assert_array_equal(second["inserted"], [False, False, False, True])
+    np.testing.assert_array_equal(second["updated"], [False, True, False, False])
+    np.testing.assert_array_equal(second["changed"], [False, True, False, True])
+
+
+def test_unchanged_rerun_scores_nothing(state):
+    dataset = pd.DataFrame({"student_id": [1, 2], "gpa": [3.1, 4.2]})
+
+    for _ in range(2):
+        state.start_run("precision")
+        changes = score_batch(state, dataset)
+        state.finish_run("precision")
+
+    assert not changes["changed"].any()
+    assert state.dataset_score("precision") == 1.0
+
+
+def test_repeated_student_ids_get_distinct_keys(state):
+    dataset = pd.DataFrame({"student_id": [1, 1, 2], "gpa": [3.1, 3.1, 4.2]})
+
+    state.start_run("precision")
+    changes = state.diff("precision", dataset)
+
+    assert len(set(changes["keys"])) == 3
+    assert changes["inserted"].all()
+
+
+def test_deleted_rows_removed_on_finish(state):
+    state.start_run("precision")
+    score_batch(state, pd.DataFrame({"student_id": [1, 2], "gpa": [3.1, 4.2]}))
+    state.finish_run("precision")
+
+    state.start_run("precision")
+    score_batch(state, pd.DataFrame({"student_id": [1], "gpa": [3.1]}))
+
+    assert state.finish_run("precision") == 1
+
+
+def test_float_student_ids_match_integer_keys(state):
+    # Пропущенный student_id в батче делает колонку float64, ключи остальных строк не должны меняться
+    state.start_run("precision")
+    score_batch(state, pd.DataFrame({"student_id": [1, 2, 3], "gpa": [3.1, 4.2, 2.8]}))
+    state.finish_run("precision")
+
+    state.start_run("precision")
+    changes = score_batch(state, pd.DataFrame({"student_id": [1, 2, 3, np.nan], "gpa": [3.1, 4.2, 2.8, 3.9]}))
+
+    np.testing.assert_array_equal(changes["changed"], [False, False, False, True])
+    assert state.finish_run("precision") == 0
+
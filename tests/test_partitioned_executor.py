@@ -0,0 +1,55 @@
+import asyncio
+import os
+from types import SimpleNamespace
+
+import pandas as pd
+import pytest
+
+import ai_etl
+
+DATA_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data_edtech.csv")
+
+
+@pytest.fixture
+def executor():
+    pytest.importorskip("pyarrow")
+    executor = ai_etl.PartitionedExecutor(processes=2, min_rows=0)
+    yield executor
+    executor.close()
+
+
+def build_index(dataset: pd.DataFrame, index: ai_etl.ConsistencyIndex = None) -> ai_etl.ConsistencyIndex:
+    source = ai_etl.DataSourceClient(reader=SimpleNamespace(iter_batches=lambda: iter([dataset])))
+    return (index or ai_etl.ConsistencyIndex()).build(source)
+
+
+def in_process(dataset: pd.DataFrame, stages: dict) -> dict:
+    return {name: function(dataset, **params) for name, (function, params) in stages.items()}
+
+
+def test_partitioned_run_matches_in_process(executor):
+    dataset = pd.read_csv(DATA_PATH)
+    rule_engine = ai_etl.RuleEngine(data_error_standart={"scholarship_amount": 1500})
+    stages = {
+        "screen": (rule_engine.screen, {"means": rule_engine.robust_means(dataset)}), 
+        "features": (build_index(dataset).features, {})
+    }
+
+    expected = in_process(dataset, stages)
+    results = asyncio.run(executor.arun(dataset, stages))
+
+    for name in stages:
+        pd.testing.assert_frame_equal(results[name], expected[name])
+
+
+def test_rebuilt_index_restarts_pool(executor):
+    dataset = pd.read_csv(DATA_PATH)
+    index = build_index(dataset.iloc[:50])
+    stages = {"features": (index.features, {})}
+    asyncio.run(executor.arun(dataset, stages))
+
+    # Тот же объект индекса перестроен по всем строкам: процессы пула не должны считать по старой копии
+    build_index(dataset, index)
+    results = asyncio.run(executor.arun(dataset, stages))
+
+    pd.testing.assert_frame_equal(results["features"], in_process(dataset, stages)["features"])
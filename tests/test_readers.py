@@ -0,0 +1,68 @@
+import sqlite3
+
+import pandas as pd
+import pytest
+
+import ai_etl
+
+
+@pytest.fixture
+def students() -> pd.DataFrame:
+    return pd.DataFrame({
+        "student_id": range(1, 8), 
+        "full_name": [f"Студент {i}" for i in range(1, 8)], 
+        "gpa": [3.5, 4.0, 4.8, 2.9, 3.1, 5.0, 3.3]
+    })
+
+
+def test_csv_reader_batches(tmp_path, students):
+    path = tmp_path / "students.csv"
+    students.to_csv(path, index=False)
+
+    batches = list(ai_etl.CsvChunkReader(str(path), batch_size=3).iter_batches())
+
+    assert [len(batch) for batch in batches] == [3, 3, 1]
+    pd.testing.assert_frame_equal(pd.concat(batches, ignore_index=True), students)
+
+
+def test_parquet_reader_batches(tmp_path, students):
+    pytest.importorskip("pyarrow")
+    path = tmp_path / "students.parquet"
+    students.to_parquet(path, index=False)
+
+    batches = list(ai_etl.ParquetReader(str(path), batch_size=3, columns=["student_id", "gpa"]).iter_batches())
+
+    assert [len(batch) for batch in batches] == [3, 3, 1]
+    pd.testing.assert_frame_equal(pd.concat(batches, ignore_index=True), students[["student_id", "gpa"]])
+
+
+def test_sql_cursor_reader_on_sqlite(students):
+    connection = sqlite3.connect(":memory:")
+    students.to_sql("students", connection, index=False)
+
+    reader = ai_etl.SqlCursorReader(connection, "SELECT * FROM students WHERE gpa >= ? ORDER BY student_id", params=(3.0,), batch_size=2)
+    batches = list(reader.iter_batches())
+
+    assert [len(batch) for batch in batches] == [2, 2, 2]
+    expected = students[students["gpa"] >= 3.0].reset_index(drop=True)
+    pd.testing.assert_frame_equal(pd.concat(batches, ignore_index=True), expected)
+    connection.close()
+
+
+def test_sql_cursor_reader_empty_result(students):
+    connection = sqlite3.connect(":memory:")
+    students.to_sql("students", connection, index=False)
+
+    reader = ai_etl.SqlCursorReader(connection, "SELECT * FROM students WHERE gpa > 10")
+
+    assert list(reader.iter_batches()) == []
+    connection.close()
+
+
+def test_data_source_reads_whole_dataset(tmp_path, students):
+    path = tmp_path / "students.csv"
+    students.to_csv(path, index=False)
+
+    data_source = ai_etl.DataSourceClient(reader=ai_etl.CsvChunkReader(str(path), batch_size=2))
+
+    pd.testing.assert_frame_equal(data_source.create_dataset(), students)
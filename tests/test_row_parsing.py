@@ -0,0 +1,58 @@
+import json
+
+import numpy as np
+import pandas as pd
+
+import ai_etl
+
+
+def test_streaming_parser_emits_rows_as_objects_close():
+    parser = ai_etl.StreamingRowParser()
+    content = 'Ответ: [{"student_id": 1, "is_valid": 1}, {"student_id": 2, "comment": "скобка } в строке", "is_valid": 0}]'
+
+    rows = []
+    emitted = []
+    for start in range(0, len(content), 7):
+        rows += parser.feed(content[start:start + 7])
+        emitted.append(len(rows))
+
+    assert rows == [{"student_id": 1, "is_valid": 1}, {"student_id": 2, "comment": "скобка } в строке", "is_valid": 0}]
+    # Первая строка отдается до конца ответа
+    assert emitted.index(1) < len(emitted) - 1
+
+
+def test_streaming_parser_skips_objects_without_student_id():
+    parser = ai_etl.StreamingRowParser()
+
+    rows = parser.feed(json.dumps({"rows": [{"student_id": 5, "is_consistent": 1}], "scores": {"accuracy": 0.9}}))
+
+    assert rows == [{"student_id": 5, "is_consistent": 1}]
+
+
+def test_row_schema_validates_ranges_and_labels():
+    schema = ai_etl.RowSchema({"is_valid_gpt": (0, 1), "validity": ["точный", "похож на правду", "не похож на правду"]})
+
+    assert schema.validate({"student_id": 3, "is_valid_gpt": "0,5", "validity": " Точный "}) == {
+        "student_id": "3", "is_valid_gpt": 0.5, "validity": "точный"
+    }
+    assert schema.validate({"student_id": 3, "is_valid_gpt": 2, "validity": "точный"}) is None
+    assert schema.validate({"student_id": 3, "is_valid_gpt": 1, "validity": "неизвестно"}) is None
+    assert schema.validate({"is_valid_gpt": 1, "validity": "точный"}) is None
+
+
+def test_row_schema_keeps_string_ids():
+    schema = ai_etl.RowSchema({"is_consistent": (0, 1)})
+
+    assert schema.validate({"student_id": "S-001", "is_consistent": 1})["student_id"] == "S-001"
+    assert ai_etl.RowSchema.row_key(7.0) == ai_etl.RowSchema.row_key("7") == ai_etl.RowSchema.row_key(np.int64(7)) == "7"
+    assert ai_etl.RowSchema.row_key(np.nan) is None
+
+
+def test_row_schema_empty_frame_types():
+    schema = ai_etl.RowSchema({"is_valid": (0, 1), "validity": ["точный", "не похож на правду"]})
+
+    frame = schema.empty_frame(pd.Index([10, 11]))
+
+    assert frame["is_valid"].dtype == float
+    assert isinstance(frame["validity"].dtype, pd.CategoricalDtype)
+    assert list(frame["validity"].cat.categories) == ["точный", "не похож на правду"]
@@ -0,0 +1,55 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import ai_etl
+
+
+@pytest.fixture
+def estimator():
+    client = ai_etl.AsyncGigaChatClient(token_provider=object())
+    yield ai_etl.SampledQualityEstimator(client=client, agents={"accuracy": None})
+    client.close()
+
+
+def test_chunk_constant_scores_widen_interval(estimator):
+    # 10 порций по 20 строк, модель ставит одну оценку на всю порцию
+    chunks = np.repeat(np.arange(10), 20)
+    scores = np.where(chunks % 2 == 0, 0.3, 0.9)
+    stratum = np.zeros(len(scores), dtype=np.uint64)
+    population = pd.Series([1000], index=np.array([0], dtype=np.uint64))
+
+    rows = estimator.estimate(stratum, scores, population)
+    clustered = estimator.estimate(stratum, scores, population, chunks)
+
+    assert clustered["estimate"] == pytest.approx(rows["estimate"])
+    assert clustered["margin"] > 3 * rows["margin"]
+
+
+def test_rule_decided_rows_are_separate_clusters(estimator):
+    # Строки, решенные правилами (-1), независимы, поэтому по ним дисперсия как по строкам
+    scores = np.tile([0.0, 1.0], 50)
+    stratum = np.zeros(len(scores), dtype=np.uint64)
+    population = pd.Series([1000], index=np.array([0], dtype=np.uint64))
+
+    rows = estimator.estimate(stratum, scores, population)
+    clustered = estimator.estimate(stratum, scores, population, np.full(len(scores), -1))
+
+    assert clustered["margin"] == pytest.approx(rows["margin"])
+
+
+def test_allocation_never_exceeds_sample_size(estimator):
+    population = pd.Series([500, 300, 5, 3, 1, 1], index=np.arange(6, dtype=np.uint64))
+
+    allocation = estimator.allocate(60, population)
+
+    assert allocation.sum() == 60
+    assert (allocation <= population).all()
+
+
+def test_batch_row_chunks_from_frame_column():
+    aggregator = ai_etl.ChunkResultAggregator()
+    frame = pd.DataFrame({"row_score": [1.0, 0.4, 0.4], "row_chunk": [-1, 0, 0]})
+
+    np.testing.assert_array_equal(aggregator.batch_row_chunks(frame), [-1, 0, 0])
+    assert aggregator.batch_row_chunks(frame.drop(columns=["row_chunk"])) is None